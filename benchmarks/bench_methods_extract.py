@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from methods_extract import extract_methods_bs4, extract_methods_lxml
+
+
+# Compare the html.parser extractor with the lxml one over saved PMC pages,
+# e.g. the www.ncbi.nlm.nih.gov/pmc/articles folder of `get_methods.py --record`.
+def read_corpus(corpus_dir):
+    pages = {}
+    for dirpath, _, filenames in os.walk(corpus_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, encoding='utf-8', errors='replace') as file:
+                pages[path] = file.read()
+
+    return pages
+
+
+def bench(extract, pages, repeat):
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path, page_html in pages.items():
+            results[path] = extract(page_html)
+    elapsed = time.perf_counter() - start
+
+    return results, elapsed
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python benchmarks/bench_methods_extract.py [corpus_dir] [repeat]")
+        exit()
+
+    pages = read_corpus(sys.argv[1])
+    repeat = int(sys.argv[2]) if len(sys.argv) == 3 else 3
+    megabytes = sum(len(page_html) for page_html in pages.values()) / 1e6
+    print(f"\n{len(pages)} pages ({megabytes:.1f} MB), {repeat} rounds\n")
+
+    reference, bs4_time = bench(extract_methods_bs4, pages, repeat)
+    fast, lxml_time = bench(extract_methods_lxml, pages, repeat)
+
+    for name, elapsed in [('bs4 html.parser', bs4_time), ('lxml subtree', lxml_time)]:
+        rate = len(pages) * repeat / elapsed if elapsed else float('inf')
+        print(f"{name:16s} {elapsed:8.2f}s  {rate:8.1f} pages/sec")
+    print(f"\nSpeedup: {bs4_time / lxml_time:.1f}x")
+
+    mismatches = [path for path in pages if reference[path] != fast[path]]
+    print(f"Identical output for {len(pages) - len(mismatches)}/{len(pages)} pages")
+    for path in mismatches:
+        print(f"  differs: {path}")
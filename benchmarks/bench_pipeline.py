@@ -0,0 +1,187 @@
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from latencies import percentiles
+from mock_servers import MockNCBI, MockOpenAI, generate_sheet
+
+
+# Runs get_methods.py, classify.py, annotate_primary.py and neaten.py one after
+# the other on synthetic sample sheets against the local mock NCBI and OpenAI
+# servers, each in its own process, and reports for every stage its throughput,
+# the latency percentiles of its requests and its peak resident memory.
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAGES = ['methods', 'classify', 'annotate', 'neaten']
+
+
+def read_latencies(filename):
+    if not os.path.exists(filename):
+        return []
+    with open(filename, newline='') as file:
+        return [float(row['seconds']) for row in csv.DictReader(file)]
+
+
+def latency_percentiles(latencies):
+    # p50, p90, p99 in seconds, the same nearest-rank ones the scripts report, or None without requests
+    return percentiles(latencies, [50, 90, 99]) if latencies else None
+
+
+def count_rows(filename):
+    with open(filename, newline='') as file:
+        return max(sum(1 for _ in csv.reader(file)) - 1, 0)
+
+
+def run_stage(name, command, log_filename):
+    # (seconds, peak RSS in MB) of a script run in its own process, output to log_filename
+    start = time.perf_counter()
+    with open(log_filename, 'w') as log:
+        process = subprocess.Popen(command, cwd=REPO_DIR, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+
+    # The child was reaped by wait4, let Popen know
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        with open(log_filename) as log:
+            print(log.read()[-3000:])
+        raise RuntimeError(f"{name} exited with {process.returncode}, see {log_filename}")
+
+    # ru_maxrss is in kilobytes on Linux
+    return elapsed, usage.ru_maxrss / 1024
+
+
+def stage_commands(run_dir, ncbi, openai, args):
+    # {stage: (command, input file, output file, latency log)}
+    python = sys.executable
+    sheet = os.path.join(run_dir, 'sheet.csv')
+    files = {stage: os.path.join(run_dir, f"{stage}.csv") for stage in STAGES}
+    logs = {stage: os.path.join(run_dir, f"{stage}.latency.csv") for stage in STAGES}
+
+    llm_options = ['--base-url', f"{openai.url}/v1", '--no-llm-cache', '--concurrency', str(args.concurrency)]
+    geo_options = ['--geo-mirror', ncbi.url, '--geo-cache', os.path.join(run_dir, 'geo')]
+
+    return {
+        'methods': ([python, 'get_methods.py', sheet, files['methods'], '--mirror', ncbi.url, '--no-cache',
+                     '--workers', str(args.workers), '--rate-limit', f"geo={args.rate},pubmed={args.rate},pmc={args.rate}",
+                     '--latency-log', logs['methods']],
+                    sheet, files['methods'], logs['methods']),
+        'classify': ([python, 'classify.py', files['methods'], files['classify'], 'mock-key', '--pack', str(args.pack),
+                      '--llm-latency-log', logs['classify']] + llm_options + geo_options,
+                     files['methods'], files['classify'], logs['classify']),
+        'annotate': ([python, 'annotate_primary.py', files['classify'], files['annotate'], 'mock-key',
+                      '--pack', str(args.pack), '--llm-latency-log', logs['annotate']] + llm_options + geo_options,
+                     files['classify'], files['annotate'], logs['annotate']),
+        'neaten': ([python, 'neaten.py', files['annotate'], files['neaten'], 'mock-key', '--no-vocab-store',
+                    '--llm-latency-log', logs['neaten']] + llm_options,
+                   files['annotate'], files['neaten'], logs['neaten']),
+    }
+
+
+def bench_rows(rows, ncbi, openai, args):
+    run_dir = tempfile.mkdtemp(prefix=f"scrawler-bench-{rows}-", dir=args.work_dir)
+    generate_sheet(os.path.join(run_dir, 'sheet.csv'), rows, args.samples_per_series)
+    print(f"\n{rows} samples in {run_dir}\n")
+
+    results = []
+    for stage, (command, input_file, output_file, latency_log) in stage_commands(run_dir, ncbi, openai, args).items():
+        before = {'ncbi': ncbi.stats(), 'openai': openai.stats()}
+        elapsed, peak_mb = run_stage(stage, command, os.path.join(run_dir, f"{stage}.log"))
+        served = {name: {kind: count - before[name].get(kind, 0) for kind, count in server.stats().items()
+                         if count != before[name].get(kind, 0)}
+                  for name, server in [('ncbi', ncbi), ('openai', openai)]}
+
+        input_rows = count_rows(input_file)
+        result = {'rows': rows, 'stage': stage, 'input_rows': input_rows, 'output_rows': count_rows(output_file),
+                  'seconds': elapsed, 'rows_per_sec': input_rows / elapsed if elapsed else 0.0,
+                  'latency': latency_percentiles(read_latencies(latency_log)), 'peak_mb': peak_mb,
+                  'requests': served}
+        results.append(result)
+        print_result(result)
+
+    if not args.keep:
+        shutil.rmtree(run_dir)
+    return results
+
+
+def print_result(result):
+    latency = result['latency']
+    latency_text = (f"p50 {latency[0] * 1000:.0f}ms, p90 {latency[1] * 1000:.0f}ms, p99 {latency[2] * 1000:.0f}ms"
+                    if latency else "latency n/a")
+    requests = ", ".join(f"{name} {sum(counts.values())} ({counts.get('429', 0)} x 429)"
+                         for name, counts in result['requests'].items() if counts)
+    print(f"{result['stage']:>9}: {result['input_rows']} rows in {result['seconds']:.1f}s "
+          f"({result['rows_per_sec']:.1f} rows/sec), {latency_text}, peak {result['peak_mb']:.0f} MB"
+          f"{', requests: ' + requests if requests else ''}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark every script end to end on synthetic sample sheets against local mock NCBI and OpenAI servers.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000],
+                        help="Sample sheet sizes to run, e.g. 1000 10000 100000 (default: 1000)")
+    parser.add_argument('--samples-per-series', type=int, default=10,
+                        help="Samples of each synthetic Series (default: 10)")
+    parser.add_argument('--fixtures', default=None,
+                        help="Pages recorded with get_methods.py --record, served instead of the synthetic ones")
+    parser.add_argument('--ncbi-latency', type=float, default=0.05,
+                        help="Seconds the mock NCBI takes per request (default: 0.05)")
+    parser.add_argument('--ncbi-429-rate', type=float, default=0.0,
+                        help="Fraction of NCBI requests answered with HTTP 429 (default: 0)")
+    parser.add_argument('--llm-latency', type=float, default=0.2,
+                        help="Seconds the mock OpenAI takes per request (default: 0.2)")
+    parser.add_argument('--llm-jitter', type=float, default=0.1,
+                        help="Up to this many seconds added to every OpenAI request at random (default: 0.1)")
+    parser.add_argument('--llm-429-rate', type=float, default=0.02,
+                        help="Fraction of OpenAI requests answered with HTTP 429 (default: 0.02)")
+    parser.add_argument('--retry-after', type=float, default=0.5,
+                        help="retry-after seconds sent with every 429 (default: 0.5)")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="get_methods.py --workers (default: 8)")
+    parser.add_argument('--rate', type=float, default=1000,
+                        help="get_methods.py requests per second for each host (default: 1000)")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="--concurrency of the LLM scripts (default: 8)")
+    parser.add_argument('--pack', type=int, default=1,
+                        help="--pack of classify.py and annotate_primary.py (default: 1)")
+    parser.add_argument('--work-dir', default=None,
+                        help="Directory for the sheets and outputs of every run (default: a temporary directory)")
+    parser.add_argument('--keep', action='store_true',
+                        help="Keep the sheets, outputs and logs of every run")
+    parser.add_argument('--json', default=None,
+                        help="Write all results to this JSON file")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    ncbi = MockNCBI(samples_per_series=args.samples_per_series, fixture_dir=args.fixtures,
+                    latency=args.ncbi_latency, rate_limit_rate=args.ncbi_429_rate, retry_after=args.retry_after)
+    openai = MockOpenAI(latency=args.llm_latency, jitter=args.llm_jitter, rate_limit_rate=args.llm_429_rate,
+                        retry_after=args.retry_after)
+    print(f"\nMock NCBI on {ncbi.url}, mock OpenAI on {openai.url}/v1")
+
+    results = []
+    try:
+        for rows in args.rows:
+            results += bench_rows(rows, ncbi, openai, args)
+    finally:
+        ncbi.close()
+        openai.close()
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f"\nResults written to: {args.json}\n")
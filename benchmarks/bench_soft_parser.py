@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GEOparse
+
+from geo_cache import series_metadata
+from soft_parser import parse_soft, parse_soft_files
+
+
+# Compare GEOparse with the streaming metadata parser over downloaded family
+# SOFT files (GSE*_family.soft.gz), e.g. what GEOparse.get_GEO leaves behind.
+def read_corpus(soft_dir):
+    paths = []
+    for dirpath, _, filenames in os.walk(soft_dir):
+        for filename in filenames:
+            if filename.endswith(('.soft', '.soft.gz')):
+                paths.append(os.path.join(dirpath, filename))
+
+    return sorted(paths)
+
+
+def parse_geoparse(path):
+    return series_metadata(GEOparse.get_GEO(filepath=path, silent=True))
+
+
+def bench(parse, paths):
+    start = time.perf_counter()
+    results = [parse(path) for path in paths]
+    return results, time.perf_counter() - start
+
+
+def parse_rss(parse, path):
+    # Growth of the peak resident memory of a fresh process while it parses one file, in MB
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    parse(path)
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024
+
+
+def peak_memory(parse, path):
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(parse_rss, parse, path).result()
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python benchmarks/bench_soft_parser.py [soft_dir] [processes]")
+        exit()
+
+    paths = read_corpus(sys.argv[1])
+    processes = int(sys.argv[2]) if len(sys.argv) == 3 else os.cpu_count()
+    megabytes = sum(os.path.getsize(path) for path in paths) / 1e6
+    print(f"\n{len(paths)} SOFT files ({megabytes:.1f} MB on disk), {processes} processes\n")
+
+    # Before anything is parsed here: a spawned child starts with the peak memory of this process
+    largest = max(paths, key=os.path.getsize)
+    geoparse_memory = peak_memory(parse_geoparse, largest)
+    stream_memory = peak_memory(parse_soft, largest)
+
+    reference, geoparse_time = bench(parse_geoparse, paths)
+    fast, stream_time = bench(parse_soft, paths)
+
+    start = time.perf_counter()
+    pooled = parse_soft_files(paths, processes)
+    pool_time = time.perf_counter() - start
+
+    for name, elapsed in [('GEOparse', geoparse_time), ('stream', stream_time), (f'stream x{processes}', pool_time)]:
+        rate = len(paths) / elapsed if elapsed else float('inf')
+        print(f"{name:16s} {elapsed:8.2f}s  {rate:8.1f} files/sec")
+    print(f"\nSpeedup: {geoparse_time / stream_time:.1f}x, {geoparse_time / pool_time:.1f}x with the process pool")
+
+    print(f"\nMemory used to parse {os.path.basename(largest)}: "
+          f"GEOparse {geoparse_memory:.1f} MB, stream {stream_memory:.1f} MB")
+
+    mismatches = [path for path, a, b, c in zip(paths, reference, fast, pooled) if not a == b == c]
+    print(f"\nIdentical metadata for {len(paths) - len(mismatches)}/{len(paths)} files")
+    for path in mismatches:
+        print(f"  differs: {path}")
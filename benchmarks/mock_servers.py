@@ -0,0 +1,364 @@
+import os
+import re
+import sys
+import ast
+import gzip
+import json
+import time
+import random
+import threading
+
+from abc import ABC, abstractmethod
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fetchers import fixture_path
+
+
+# Local stand-ins for NCBI (GEO series pages, PubMed records, the PMC ID
+# converter, PMC articles and GEO family SOFT files) and for the OpenAI chat
+# completions API, for benchmarking the scripts end to end with --mirror,
+# --geo-mirror and --base-url. Pages are served from recorded fixtures
+# (get_methods.py --record) when there is one, otherwise they are generated
+# from the accession, the same way generate_sheet numbers them:
+#   GSE{100000 + i} has samples GSM{1000000 + i * 100 + j}
+#   every 10th Series has no PubMed record, every 7th has two
+#   4 in 5 PubMed records have a PMC article
+FIRST_GSE = 100000
+FIRST_GSM = 1000000
+FIRST_PMID = 30000000
+FIRST_PMC = 9000000
+
+METHODS_SENTENCES = [
+    "Tissue samples were obtained from patients undergoing surgery after informed consent.",
+    "Single cell suspensions were prepared by enzymatic dissociation with collagenase IV.",
+    "Libraries were generated with the Chromium Single Cell 3' kit and sequenced on a NovaSeq 6000.",
+    "Reads were aligned to GRCh38 with Cell Ranger and cells with fewer than 200 genes were removed.",
+    "Clusters were annotated with canonical marker genes after batch correction with Harmony.",
+    "Peripheral blood mononuclear cells were isolated by Ficoll density gradient centrifugation.",
+]
+
+# Free-text answers of the mock annotator, some of which neaten.py has to map
+DISEASES = ["nan", "nan", "Alzheimer's disease", "covid19", "Type 2 diabetes", "NSCLC",
+            "lung adenocarcinoma", "idiopathic pulmonary fibrosis"]
+ORGANS = ["Lung", "Blood", "Liver", "Brain"]
+
+
+def series_index(gse_id):
+    return int(gse_id[3:]) - FIRST_GSE
+
+
+def gse_accession(index):
+    return f"GSE{FIRST_GSE + index}"
+
+
+def gsm_accession(index, sample):
+    return f"GSM{FIRST_GSM + index * 100 + sample}"
+
+
+def series_pmids(gse_id):
+    index = series_index(gse_id)
+    if index % 10 == 9:
+        return []
+    pmids = [str(FIRST_PMID + 2 * index)]
+    if index % 7 == 3:
+        pmids.append(str(FIRST_PMID + 2 * index + 1))
+    return pmids
+
+
+def pmid_pmc(pmid):
+    offset = int(pmid) - FIRST_PMID
+    return None if offset % 5 == 4 else f"PMC{FIRST_PMC + offset}"
+
+
+def methods_text(pmc, sentences=12):
+    rng = random.Random(pmc)
+    return " ".join(rng.choice(METHODS_SENTENCES) for _ in range(sentences))
+
+
+def geo_page(gse_id):
+    links = "".join(f'<a href="/pubmed/{pmid}" title="Link to PubMed record">{pmid}</a> '
+                    for pmid in series_pmids(gse_id))
+    return (f"<html><body><table><tr><td>Series</td><td>{gse_id}</td></tr>"
+            f"<tr><td>Citation(s)</td><td>{links}</td></tr></table></body></html>")
+
+
+def pubmed_page(pmid):
+    pmc = pmid_pmc(pmid)
+    items = f'<li><span class="identifier pubmed">PMID: <strong>{pmid}</strong></span></li>'
+    if pmc:
+        items += f'<li><span class="identifier pmc">PMCID: <a href="/pmc/articles/{pmc}/">{pmc}</a></span></li>'
+    return f'<html><body><h1>Article {pmid}</h1><ul id="full-view-identifiers">{items}</ul></body></html>'
+
+
+def pmc_page(pmc):
+    return (f'<html><body><div id="intro"><h2>Introduction</h2><p>Background of {pmc}.</p></div>'
+            f'<div id="methods"><h2>Materials and Methods</h2><p>{methods_text(pmc)}</p></div>'
+            f'<div id="refs"><h2>References</h2><p>None.</p></div></body></html>')
+
+
+def idconv_records(ids):
+    records = []
+    for pmid in ids:
+        record = {'pmid': pmid}
+        if pmid_pmc(pmid):
+            record['pmcid'] = pmid_pmc(pmid)
+        records.append(record)
+    return json.dumps({'status': 'ok', 'records': records})
+
+
+def family_soft(gse_id, samples_per_series, table_rows=200):
+    # Gzipped family SOFT file with a small data table per sample
+    lines = [f"^SERIES = {gse_id}",
+             f"!Series_title = Synthetic single cell atlas {gse_id}",
+             f"!Series_summary = Single cell RNA sequencing of human tissue in {gse_id}.",
+             f"!Series_overall_design = {samples_per_series} samples of patients and healthy donors."]
+    for sample in range(samples_per_series):
+        gsm_id = gsm_accession(series_index(gse_id), sample)
+        lines += [f"^SAMPLE = {gsm_id}",
+                  f"!Sample_title = Sample {sample} of {gse_id}",
+                  f"!Sample_geo_accession = {gsm_id}",
+                  f"!Sample_source_name_ch1 = {ORGANS[sample % len(ORGANS)]} tissue",
+                  f"!Sample_characteristics_ch1 = tissue: {ORGANS[sample % len(ORGANS)]}",
+                  f"!Sample_characteristics_ch1 = age: {20 + sample}",
+                  "!Sample_extract_protocol_ch1 = Cells were dissociated and loaded on the Chromium controller.",
+                  "#ID_REF = Gene",
+                  "#VALUE = Normalized count",
+                  "!sample_table_begin",
+                  "ID_REF\tVALUE"]
+        lines += [f"gene{row}\t{row % 97}" for row in range(table_rows)]
+        lines.append("!sample_table_end")
+
+    return gzip.compress(("\n".join(lines) + "\n").encode('utf-8'), compresslevel=1)
+
+
+class MockServer(ABC):
+    # A ThreadingHTTPServer in a background thread that answers after `latency`
+    # (+ up to `jitter`) seconds and with HTTP 429 for a `rate_limit_rate`
+    # fraction of the requests. Counts requests per kind of page.
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_rate=0.0, retry_after=0.5, seed=0, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def wait(self):
+        # (seconds to wait, whether to answer with 429)
+        with self.lock:
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            limited = self.random.random() < self.rate_limit_rate
+        return delay, limited
+
+    def count(self, kind):
+        with self.lock:
+            self.counts[kind] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+    @abstractmethod
+    def respond(self, path, body):
+        # (status, content type, body bytes) for a request
+        ...
+
+    def make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_request(self, body=None):
+                delay, limited = mock.wait()
+                time.sleep(delay)
+
+                if limited:
+                    mock.count('429')
+                    self.send(429, 'application/json', b'{"error": {"message": "Rate limit reached"}}',
+                              {'retry-after': str(mock.retry_after)})
+                    return
+
+                status, content_type, payload = mock.respond(self.path, body)
+                self.send(status, content_type, payload)
+
+            def send(self, status, content_type, payload, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.handle_request()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self.handle_request(self.rfile.read(length))
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class MockNCBI(MockServer):
+    # NCBI at /{host}/{path}?query, the layout of get_methods.py --mirror and
+    # geo_cache.py --geo-mirror
+
+    def __init__(self, samples_per_series=10, fixture_dir=None, **options):
+        self.samples_per_series = samples_per_series
+        self.fixture_dir = fixture_dir
+        super().__init__(**options)
+
+    def respond(self, path, body=None):
+        url = "https:/" + path
+        if self.fixture_dir:
+            fixture = fixture_path(self.fixture_dir, url)
+            if os.path.isfile(fixture):
+                self.count('fixture')
+                with open(fixture, 'rb') as file:
+                    return 200, 'text/html; charset=utf-8', file.read()
+
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        segments = [segment for segment in parts.path.split('/') if segment]
+
+        if parts.netloc == 'pubmed.ncbi.nlm.nih.gov' and segments:
+            self.count('pubmed')
+            return 200, 'text/html; charset=utf-8', pubmed_page(segments[0]).encode('utf-8')
+
+        if parts.path.startswith('/geo/query/acc.cgi') and 'acc' in query:
+            self.count('geo')
+            return 200, 'text/html; charset=utf-8', geo_page(query['acc'][0]).encode('utf-8')
+
+        if parts.path.startswith('/pmc/utils/idconv') and 'ids' in query:
+            self.count('idconv')
+            return 200, 'application/json', idconv_records(query['ids'][0].split(',')).encode('utf-8')
+
+        if parts.path.startswith('/pmc/articles/') and len(segments) >= 3:
+            self.count('pmc')
+            return 200, 'text/html; charset=utf-8', pmc_page(segments[2]).encode('utf-8')
+
+        if parts.netloc == 'ftp.ncbi.nlm.nih.gov' and path.endswith('_family.soft.gz'):
+            self.count('soft')
+            gse_id = segments[-1].split('_')[0]
+            return 200, 'application/gzip', family_soft(gse_id, self.samples_per_series)
+
+        self.count('404')
+        return 404, 'text/plain', b'Not found'
+
+
+# What the prompts of classify.py, annotate_primary.py, classify_annotate.py and neaten.py ask for
+PACKED_SAMPLE = re.compile(r"Description about sample (GSM\d+)")
+GSM_ID = re.compile(r"GSM\d+")
+ANSWER_KEY = re.compile(r'"(\w+)": "\[answer\]"')
+SET_A = re.compile(r"\[A\]: (\[.*?\])\n")
+
+
+def sample_answers(gsm_id, keys):
+    # Answers for one sample, the same on every run
+    rng = random.Random(gsm_id)
+    disease = rng.choice(DISEASES)
+    values = {
+        'Category': 'Primary' if rng.random() < 0.8 else rng.choice(['Cultured', 'Fetal']),
+        'Organ': rng.choice(ORGANS),
+        'Healthy': 'Yes' if disease == 'nan' else 'nan',
+        'Disease': disease,
+        'Cancer_Tissue': 'Tumor' if disease in ('NSCLC', 'lung adenocarcinoma') else 'nan',
+        'Age': str(rng.randint(18, 90)),
+        'Sex': rng.choice(['F', 'M']),
+    }
+    return {key: values.get(key, 'nan') for key in keys}
+
+
+def mock_answer(prompt):
+    # Answer text for the first user message of a conversation
+    words = SET_A.search(prompt)
+    if words:
+        return json.dumps({word: word for word in ast.literal_eval(words.group(1))})
+
+    keys = ANSWER_KEY.findall(prompt)
+    packed = PACKED_SAMPLE.findall(prompt)
+    if packed:
+        if keys:
+            return json.dumps({gsm_id: sample_answers(gsm_id, keys) for gsm_id in packed})
+        return json.dumps({gsm_id: sample_answers(gsm_id, ['Category'])['Category'] for gsm_id in packed})
+
+    gsm_ids = GSM_ID.findall(prompt)
+    gsm_id = gsm_ids[0] if gsm_ids else ''
+    if keys:
+        return json.dumps(sample_answers(gsm_id, keys))
+    return sample_answers(gsm_id, ['Category'])['Category']
+
+
+class MockOpenAI(MockServer):
+    # POST /v1/chat/completions with answers in the format the prompt asks for
+
+    def respond(self, path, body=None):
+        if not urlsplit(path).path.endswith('/chat/completions') or body is None:
+            self.count('404')
+            return 404, 'application/json', b'{"error": {"message": "Not found"}}'
+
+        request = json.loads(body)
+        messages = request['messages']
+        self.count('reask' if len(messages) > 1 else 'chat')
+
+        content = mock_answer(messages[0]['content'])
+        prompt_tokens = sum(len(message['content']) for message in messages) // 4
+        completion_tokens = len(content) // 4 + 1
+        response = {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }
+        return 200, 'application/json', json.dumps(response).encode('utf-8')
+
+
+def generate_sheet(filename, rows, samples_per_series=10):
+    # Sample sheet with Series and Sample Name columns, `rows` samples in Series of samples_per_series
+    with open(filename, 'w') as file:
+        file.write("Series,Sample Name\n")
+        for row in range(rows):
+            index, sample = divmod(row, samples_per_series)
+            file.write(f"{gse_accession(index)},{gsm_accession(index, sample)}\n")
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python benchmarks/mock_servers.py [ncbi_port] [openai_port] [fixture_dir]")
+        exit()
+
+    ncbi = MockNCBI(fixture_dir=sys.argv[3] if len(sys.argv) == 4 else None, port=int(sys.argv[1]))
+    openai = MockOpenAI(port=int(sys.argv[2]))
+    print(f"\nNCBI on {ncbi.url} (--mirror, --geo-mirror), OpenAI on {openai.url}/v1 (--base-url)\n")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        ncbi.close()
+        openai.close()
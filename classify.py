@@ -1,106 +1,121 @@
 import pandas as pd
-import numpy as np
 import csv
-import time
-import random
-import sys
-import os
-import subprocess
+import argparse
 
-from tqdm import tqdm
-import GEOparse
+from methods_store import series_methods
+from geo_cache import add_geo_arguments, geo_from_args
+from prompt_pack import PackedAnswers
+from token_budget import METHODS_PLACEHOLDER, add_budget_arguments, budget_from_args
+from llm_engine import LLMEngine, add_llm_arguments, engine_from_args
+from llm_resume import start_output
+from llm_answers import JSON_OBJECT
+from prompts import FOCUS, introduction, classification, metadata, prompt_jobs, add_sample_arguments
 
-from openai import OpenAI
 
-def read_input(input_filename):
+CATEGORIES = ['Cultured', 'Fetal', 'Primary']
+OUTPUT_COLUMNS = ['Series', 'Sample Name', 'Category']
+
+
+def read_input(input_filename, methods_store=None):
     df = pd.read_csv(input_filename)
 
+    # Methods text is either in the sheet, or in a separate store referenced by PMC
+    method_column = 'PMC' if methods_store else 'Method'
+
     try:
-        df = df[['Series', 'Sample Name', 'Method']]
+        df = df[['Series', 'Sample Name', method_column]]
     except:
-        print("\nError! You input should have ['Series', 'Sample Name', 'Method'] columns.\n")
+        print(f"\nError! You input should have ['Series', 'Sample Name', '{method_column}'] columns.\n")
         exit()
 
     return df
 
 
-def classify_category(api_key, df, output_filename):
+def parse_category(answer):
+    # "Primary", "primary.", "**Primary**" or "Category: Primary" -> "Primary", None for anything else
+    if not isinstance(answer, str):
+        return None
+
+    word = answer.split(':')[-1].strip().strip('.*"\'` \n').capitalize()
+    return word if word in CATEGORIES else None
+
+
+def classified(frame):
+    # Output rows that do not need to be asked again
+    return frame['Category'].str.strip().isin(CATEGORIES)
 
-    client = OpenAI(
-        api_key=api_key,
-    )
 
-    # gpt_model = 'gpt-3.5-turbo'
-    gpt_model = 'gpt-4-0125-preview' 
-    
-    methods_df = df
+def classify_category(api_key, df, output_filename, methods_store=None, engine=None, pack=1, budget=None,
+                      geo=None, resume=False):
 
-    with open(output_filename, 'w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(['Series', 'Sample Name', 'Category'])
+    # Requests are sent concurrently by the engine, answers come back in order
+    if engine is None:
+        engine = LLMEngine(api_key)
 
-    # Create method data for each GSE as a dictionary
-    gse_method_dict = methods_df.groupby('Series')['Method'].first().to_dict()
+    # With resume, only samples without a valid answer in the output are asked (again)
+    done = start_output(output_filename, OUTPUT_COLUMNS, resume, classified)
+    methods_df = df[~df['Sample Name'].isin(done)]
+
+    # Create method data for each GSE as a dictionary (read lazily from the store if given)
+    gse_method_dict = series_methods(methods_df, methods_store)
 
     # subset GSE
     number_of_GSE = len(set(methods_df['Series']))
     print(f"Total number of GSE IDs: {number_of_GSE}")   
 
-    for gse_id, method_text in tqdm(gse_method_dict.items()):
-        
-        # GEOparse
-        try:
-            gse = GEOparse.get_GEO(geo=gse_id, silent=True)
-        except Exception as e:
-            print(f"Error downloading {gse_id}: {e}")
-            continue
-            
-        context_gse_1 = " ".join(gse.metadata['summary'])
-        context_gse_2 = " ".join(gse.metadata['overall_design'])
-
-        # GPT prompt for each GSM
-        for gsm_id in gse.gsms:
-            
-            # We only want information of GSMs in our metadata
-            if gsm_id not in methods_df['Sample Name'].values:
-                continue
-            
-            # GEOparse info for that GSM
-            gsm = gse.gsms[gsm_id]
-            context_gsm_1 = " ".join(gsm.metadata.get('characteristics_ch1', []))
-            context_gsm_2 = " ".join(gsm.metadata.get('title', []))
-            context_gsm_3 = " ".join(gsm.metadata.get('geo_accession', []))
-            context_gsm_4 = " ".join(gsm.metadata.get('source_name_ch1', []))
-            context_gsm_5 = " ".join(gsm.metadata.get('extract_protocol_ch1', []))
-            context_gsm_6 = " ".join(gsm.metadata.get('characteristics_ch1', []))
-            
-            # Ask GPT with GEOparse-GSMcharacteristics and PMC-method
-            prompt = f"You are an expert biologist. You are looking at some metadata provided by Gene Expression Omnibus and the method section of the original manuscript. Please use the given metadata of the overall experiment and the metadata of the particular sample from that experiment to answer a few questions about the particular sample. "
-            prompt += f"Based on its characteristics and method, classify the sample with one of the following options - [Cultured, Fetal, Primary]. If the sample is an in vitro sample, classify as Cultured. If the sample is from fetal tissue, classify as Fetal. If the sample is none of those, answer with Primary. Isolation of a specific cell type from blood and direct sequencing is not treated as cultured. Do not classify samples derived from the mother as fetal. Please use the given metadata of the overall experiment and the metadata of the particular sample from that experiment to answer a few questions about the particular sample. Do not be confused by the experiment metadata if the experiment mentions multiple samples. Prioritize the description about the particular sample in the experiment when answering questions."
-            prompt += f"Please respond with one word only. "
-            prompt += f"\n Here are the metadata associated: \n\n Description about the experiment: \n {context_gse_1} \n {context_gse_2}"
-            prompt += f"\n Description about the particular sample in the experiment: \n {context_gsm_1} \n {context_gsm_2} \n {context_gsm_3} \n {context_gsm_4} \n {context_gsm_5} \n {context_gsm_6}"
-            prompt += f"\n Method of the original manuscript: {method_text}"
-            
-            try:
-                response = client.chat.completions.create(
-                    model=gpt_model,
-                    messages=[
-                        {"role": "user", "content": prompt},
-                    ],
-                    temperature=0,
-                )
-                answer = response.choices[0].message.content
-                
-            except Exception as e:
-                print(f"Error processing {gsm_id}: {e}")
-                answer = "Error"    
-            
-            with open(output_filename, 'a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow([gse_id, gsm_id, answer])
-            
-            time.sleep(random.uniform(0.5, 1.5))  # Wait like a human
+    # One category per GSM of the chunk
+    answers = PackedAnswers(pack != 1, parse_category, parse_category)
+
+    def write(key, answer):
+        gse_id, _ = key
+        # Unreadable single answers are kept as they are, packed ones become "Error"
+        rows = [[gse_id, gsm_id, category or (answer if pack == 1 else "Error")]
+                for gsm_id, category in answers.results(key, answer).items()]
+
+        with open(output_filename, 'a', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerows(rows)
+
+    # Packed prompts ask for JSON, single prompts for one word
+    response_format = JSON_OBJECT if pack != 1 else None
+    engine.run(classify_jobs(methods_df, gse_method_dict, pack, budget, geo), write, answers.valid, response_format)
+    engine.report()
+    if budget is not None:
+        budget.report()
+    if geo is not None:
+        geo.report()
+
+
+def classify_prompt(experiment, chunk, packed):
+    # Ask GPT with GEOparse-GSMcharacteristics and PMC-method
+    if not packed:
+        return single_prompt(experiment, chunk[0][1])
+
+    prompt = introduction(packed, "a question")
+    prompt += classification(packed) + FOCUS
+    prompt += metadata(experiment, chunk, packed)
+
+    # Formatting output
+    prompt += f"\n Respond with a JSON object only, mapping the GSM ID of every sample to its class, e.g. {{\"{chunk[0][0]}\": \"Primary\"}}. "
+
+    return prompt
+
+
+def single_prompt(experiment, sample_text):
+    # The original per-sample prompt, kept as it is so earlier answers stay comparable
+    prompt = f"You are an expert biologist. You are looking at some metadata provided by Gene Expression Omnibus and the method section of the original manuscript. Please use the given metadata of the overall experiment and the metadata of the particular sample from that experiment to answer a few questions about the particular sample. "
+    prompt += f"Based on its characteristics and method, classify the sample with one of the following options - [Cultured, Fetal, Primary]. If the sample is an in vitro sample, classify as Cultured. If the sample is from fetal tissue, classify as Fetal. If the sample is none of those, answer with Primary. Isolation of a specific cell type from blood and direct sequencing is not treated as cultured. Do not classify samples derived from the mother as fetal. Please use the given metadata of the overall experiment and the metadata of the particular sample from that experiment to answer a few questions about the particular sample. Do not be confused by the experiment metadata if the experiment mentions multiple samples. Prioritize the description about the particular sample in the experiment when answering questions."
+    prompt += f"Please respond with one word only. "
+    prompt += f"\n Here are the metadata associated: \n\n Description about the experiment: \n {experiment}"
+    prompt += f"\n Description about the particular sample in the experiment: \n {sample_text}"
+    prompt += f"\n Method of the original manuscript: {METHODS_PLACEHOLDER}"
+
+    return prompt
+
+
+def classify_jobs(methods_df, gse_method_dict, pack=1, budget=None, geo=None):
+    # One prompt per GSM, or with pack != 1 per chunk of GSMs of a GSE, see prompts.prompt_jobs
+    return prompt_jobs(methods_df, gse_method_dict, classify_prompt, pack, budget, geo)
 
 
 def merge_methods_to_output(df, output_filename):
@@ -111,33 +126,38 @@ def merge_methods_to_output(df, output_filename):
     final_df.to_csv(output_filename, index=False)
 
 
-def remove_GEOparse_pybroduct():
-    pwd = os.getcwd()
-    if subprocess.call(f"rm {pwd}/GSE*.gz", shell=True):
-        print("Error occured while removing unnecessary GEOparse byproduct files.")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Classify each sample as Cultured, Fetal or Primary.")
+    parser.add_argument('input_file')
+    parser.add_argument('output_file')
+    parser.add_argument('api_key')
+    add_sample_arguments(parser)
+    add_budget_arguments(parser)
+    add_geo_arguments(parser)
+    add_llm_arguments(parser)
+
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
 
-    if len(sys.argv) != 4:
-        print("Usage: python classify.py [input_file] [output_file] [API key]")
-        exit()
-    
-    input_filename = sys.argv[1]
-    output_filename = sys.argv[2]
-    api_key = sys.argv[3]
+    args = parse_args()
+
+    input_filename = args.input_file
+    output_filename = args.output_file
+    api_key = args.api_key
 
     # Read input and check format
-    df = read_input(input_filename)
+    df = read_input(input_filename, args.methods_store)
 
-    # Run GPT
-    classify_category(api_key, df, output_filename)
+    # Run GPT, the GEO prefetch threads and parse processes stop at the end
+    with geo_from_args(args) as geo:
+        classify_category(api_key, df, output_filename, args.methods_store, engine_from_args(api_key, args), args.pack,
+                          budget_from_args(args), geo, args.resume)
 
-    # We need Methods in step 2
+    # We need Methods (or their PMC) in step 2
     merge_methods_to_output(df, output_filename)
 
     print(f"\nYou can check your result in: {output_filename}\n")
 
-    remove_GEOparse_pybroduct()
-
 
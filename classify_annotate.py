@@ -0,0 +1,156 @@
+import csv
+import argparse
+
+import pandas as pd
+
+from methods_store import series_methods
+from geo_cache import add_geo_arguments, geo_from_args
+from prompt_pack import PackedAnswers
+from token_budget import add_budget_arguments, budget_from_args
+from llm_engine import LLMEngine, add_llm_arguments, engine_from_args
+from llm_resume import read_done, write_done
+from llm_answers import JSON_OBJECT, parse_answer, check_fields
+from prompts import (questions_introduction, classification, annotation_questions, metadata, json_answer, prompt_jobs,
+                     add_sample_arguments)
+from classify import OUTPUT_COLUMNS as CLASSIFY_COLUMNS, read_input, merge_methods_to_output, classified, parse_category
+from annotate_primary import OUTPUT_COLUMNS as ANNOTATE_COLUMNS, ANNOTATION_FIELDS, load_term_lists, annotated
+
+
+FUSED_FIELDS = ['Category'] + ANNOTATION_FIELDS
+
+
+def classify_and_annotate(api_key, df, classify_filename, annotate_filename, methods_store=None, engine=None,
+                          pack=1, budget=None, geo=None, resume=False):
+    # One GEO download per GSE and one prompt per GSM (or per chunk of GSMs) for both steps.
+    # Writes the same two files as classify.py and annotate_primary.py.
+    organ_list, disease_list, cancer_tissue_list = load_term_lists()
+
+    if engine is None:
+        engine = LLMEngine(api_key)
+
+    # With resume, a sample is done if it has a valid Category and, for Primary
+    # samples, a complete annotation. Both files keep only the samples that are done.
+    done = set()
+    classify_done = pd.DataFrame(columns=CLASSIFY_COLUMNS)
+    annotate_done = pd.DataFrame(columns=ANNOTATE_COLUMNS)
+    if resume:
+        classify_done = read_done(classify_filename, CLASSIFY_COLUMNS, classified)
+        annotate_done = read_done(annotate_filename, ANNOTATE_COLUMNS, annotated)
+
+        primary = classify_done['Category'].str.strip() == 'Primary'
+        done = set(classify_done.loc[~primary, 'Sample Name'])
+        done |= set(classify_done.loc[primary, 'Sample Name']) & set(annotate_done['Sample Name'])
+        print(f"Resuming: {len(done)} samples already done")
+
+    write_done(classify_filename, CLASSIFY_COLUMNS, classify_done[classify_done['Sample Name'].isin(done)])
+    write_done(annotate_filename, ANNOTATE_COLUMNS, annotate_done[annotate_done['Sample Name'].isin(done)])
+
+    methods_df = df[~df['Sample Name'].isin(done)]
+
+    # Create method data for each GSE as a dictionary (read lazily from the store if given)
+    gse_method_dict = series_methods(methods_df, methods_store)
+
+    # subset GSE
+    number_of_GSE = len(set(methods_df['Series']))
+    print(f"Total number of GSE IDs: {number_of_GSE}")
+
+    # Category and annotation values per GSM of the chunk
+    answers = PackedAnswers(pack != 1, lambda answer: fused_fields(parse_answer(answer, FUSED_FIELDS)), fused_fields)
+
+    def write(key, answer):
+        gse_id, _ = key
+        classify_rows = []
+        annotate_rows = []
+        for gsm_id, values in answers.results(key, answer).items():
+            values = values or ["Error"] * len(FUSED_FIELDS)
+            classify_rows.append([gse_id, gsm_id, values[0]])
+
+            # Only Primary samples are annotated
+            if values[0] == 'Primary':
+                annotate_rows.append([gse_id, gsm_id] + values[1:])
+
+        with open(classify_filename, 'a', newline='') as file:
+            csv.writer(file).writerows(classify_rows)
+        with open(annotate_filename, 'a', newline='') as file:
+            csv.writer(file).writerows(annotate_rows)
+
+    jobs = fused_jobs(methods_df, gse_method_dict, organ_list, disease_list, cancer_tissue_list, pack, budget, geo)
+    engine.run(jobs, write, answers.valid, JSON_OBJECT)
+    engine.report()
+    if budget is not None:
+        budget.report()
+    if geo is not None:
+        geo.report()
+
+
+def fused_fields(result):
+    # Category and annotation values of one GSM in output column order,
+    # None if a field is missing or the Category is unknown
+    result = check_fields(result, FUSED_FIELDS)
+    category = parse_category(result['Category']) if result is not None else None
+    if category is None:
+        return None
+
+    return [category] + [result[field] for field in ANNOTATION_FIELDS]
+
+
+def fused_prompt(experiment, chunk, packed, organ_list, disease_list, cancer_tissue_list):
+    # Introduction
+    prompt = questions_introduction(packed)
+
+    # Classification
+    prompt += "\n [Category] " + classification(packed) + "Answer with one word only. "
+    prompt += "\n Answer the questions below only if the Category is Primary, otherwise answer them with *nan*. \n"
+
+    # Main questions, Age, Sex and tuning
+    prompt += annotation_questions(organ_list, disease_list, cancer_tissue_list)
+
+    # Providing data
+    prompt += metadata(experiment, chunk, packed)
+
+    # Formatting output
+    prompt += json_answer(FUSED_FIELDS, chunk, packed)
+
+    return prompt
+
+
+def fused_jobs(methods_df, gse_method_dict, organ_list, disease_list, cancer_tissue_list, pack=1, budget=None, geo=None):
+    # One prompt per GSM, or with pack != 1 per chunk of GSMs of a GSE, see prompts.prompt_jobs
+    def build(experiment, chunk, packed):
+        return fused_prompt(experiment, chunk, packed, organ_list, disease_list, cancer_tissue_list)
+
+    return prompt_jobs(methods_df, gse_method_dict, build, pack, budget, geo)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Classify every sample and annotate the Primary ones with one GEO download and one prompt per sample.")
+    parser.add_argument('input_file')
+    parser.add_argument('classify_output_file', help="Same format as the output of classify.py")
+    parser.add_argument('annotate_output_file', help="Same format as the output of annotate_primary.py")
+    parser.add_argument('api_key')
+    add_sample_arguments(parser)
+    add_budget_arguments(parser)
+    add_geo_arguments(parser)
+    add_llm_arguments(parser)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    # Read input and check format
+    df = read_input(args.input_file, args.methods_store)
+
+    # Run GPT, the GEO prefetch threads and parse processes stop at the end
+    with geo_from_args(args) as geo:
+        classify_and_annotate(args.api_key, df, args.classify_output_file, args.annotate_output_file, args.methods_store,
+                              engine_from_args(args.api_key, args), args.pack, budget_from_args(args),
+                              geo, args.resume)
+
+    # We need Methods (or their PMC) in step 2
+    merge_methods_to_output(df, args.classify_output_file)
+
+    print(f"\nYou can check your result in: {args.classify_output_file} and {args.annotate_output_file}\n")
@@ -0,0 +1,437 @@
+import os
+import csv
+import time
+import queue
+import hashlib
+import threading
+
+from contextlib import contextmanager
+from collections import Counter, defaultdict
+
+from urllib.parse import urlsplit, quote
+
+import requests
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.chrome.service import Service
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+from latencies import percentiles
+from retries import parse_retry_after, backoff_delay
+
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36"
+
+
+def mirror_url(url, mirror):
+    # https://host/path?query -> {mirror}/host/path?query
+    parts = urlsplit(url)
+    new_url = f"{mirror.rstrip('/')}/{parts.netloc}{parts.path}"
+    if parts.query:
+        new_url += f"?{parts.query}"
+    return new_url
+
+
+def fixture_path(fixture_dir, url):
+    # One file per URL: {fixture_dir}/{host}/{path}/{query or 'index'}
+    parts = urlsplit(url)
+    path_parts = [quote(p, safe='') for p in parts.path.split('/') if p]
+    name = quote(parts.query, safe='=&,') if parts.query else 'index'
+    if len(name) > 200:
+        name = hashlib.sha1(parts.query.encode()).hexdigest()
+    return os.path.join(fixture_dir, parts.netloc, *path_parts, name)
+
+
+# Requests per second for each NCBI site
+DEFAULT_RATES = {'geo': 3.0, 'pubmed': 3.0, 'pmc': 3.0}
+
+
+def host_key(url):
+    # Which rate budget a URL belongs to
+    parts = urlsplit(url)
+    if parts.netloc.startswith('pubmed'):
+        return 'pubmed'
+    if parts.path.startswith('/pmc'):
+        return 'pmc'
+    if parts.path.startswith('/geo'):
+        return 'geo'
+    return parts.netloc
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Block until a token is available
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class RateLimiter:
+    # One token bucket per host, hosts without a budget are not throttled
+
+    def __init__(self, rates=None):
+        self.buckets = {host: TokenBucket(rate) for host, rate in (rates or {}).items() if rate}
+
+    def acquire(self, url):
+        bucket = self.buckets.get(host_key(url))
+        if bucket:
+            bucket.acquire()
+
+
+class RetryableError(Exception):
+    # 429 or 5xx, worth trying again after a while
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Fetcher:
+    name = 'base'
+
+    # Number of threads that may call get() at the same time, None for no limit
+    max_workers = None
+
+    # Whether get() returns the raw response body (JSON APIs) rather than a rendered page
+    raw = True
+
+    def __init__(self, mirror=None, record_dir=None, limiter=None, max_retries=5):
+        self.mirror = mirror
+        self.record_dir = record_dir
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+        # Throughput stats
+        self.pages = 0
+        self.started = None
+        self.finished = None
+        self.stats_lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.ready_timeouts = Counter()
+
+    def get(self, url, ready=None):
+        # Return page HTML, None if the page does not exist. `ready` is the XPath of
+        # the element a rendered page has to show before it is read (browsers only).
+        with self.stats_lock:
+            if self.started is None:
+                self.started = time.perf_counter()
+
+        target = mirror_url(url, self.mirror) if self.mirror else url
+
+        for attempt in range(self.max_retries + 1):
+            if self.limiter:
+                self.limiter.acquire(url)
+            try:
+                page_start = time.perf_counter()
+                page_html = self._get(target, ready)
+                break
+            except RetryableError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = e.retry_after if e.retry_after is not None else backoff_delay(attempt)
+                time.sleep(delay)
+
+        with self.stats_lock:
+            self.pages += 1
+            self.finished = time.perf_counter()
+            self.latencies[host_key(url)].append(self.finished - page_start)
+
+        if self.record_dir and page_html is not None:
+            path = fixture_path(self.record_dir, url)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(page_html)
+
+        return page_html
+
+    def _get(self, url, ready=None):
+        raise NotImplementedError
+
+    def pages_per_sec(self):
+        if not self.pages or self.finished == self.started:
+            return 0.0
+        return self.pages / (self.finished - self.started)
+
+    def report(self):
+        elapsed = (self.finished - self.started) if self.pages else 0.0
+        print(f"[{self.name}] {self.pages} pages in {elapsed:.1f}s ({self.pages_per_sec():.2f} pages/sec)")
+
+        # Per-page latency, to tune the readiness timeouts
+        for host, latencies in sorted(self.latencies.items()):
+            p50, p90, p99 = percentiles(latencies, [50, 90, 99])
+            line = f"  {host}: p50 {p50:.2f}s, p90 {p90:.2f}s, p99 {p99:.2f}s, max {max(latencies):.2f}s"
+            if self.ready_timeouts[host]:
+                line += f", {self.ready_timeouts[host]} readiness timeouts"
+            print(line)
+
+    def write_latencies(self, filename):
+        with open(filename, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['host', 'seconds'])
+            for host, latencies in sorted(self.latencies.items()):
+                writer.writerows([host, f"{latency:.4f}"] for latency in latencies)
+
+    def close(self):
+        pass
+
+
+class HttpFetcher(Fetcher):
+    name = 'http'
+
+    def __init__(self, mirror=None, record_dir=None, limiter=None, max_retries=5, timeout=30):
+        super().__init__(mirror, record_dir, limiter, max_retries)
+        self.timeout = timeout
+
+        # One session per thread
+        self.local = threading.local()
+        self.sessions = []
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+            self.local.session = session
+            self.sessions.append(session)
+        return self.local.session
+
+    def _get(self, url, ready=None):
+        response = self.session().get(url, timeout=self.timeout)
+
+        if response.status_code == 404:
+            return None
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableError(response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+
+        response.raise_for_status()
+        return response.text
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
+
+
+def make_driver(page_load_timeout=60):
+    # Selenium setting
+    chrome_options = webdriver.ChromeOptions()
+    chrome_options.add_argument('window-size=1920x1080')
+    chrome_options.add_argument('--headless')
+    chrome_options.add_argument('--no-sandbox')
+    chrome_options.add_argument("--single-process")
+
+    chrome_options.add_argument('--disable-gpu')
+    chrome_options.add_argument('--disable-setuid-sandbox')
+    chrome_options.add_argument('--disable-dev-shm-usage')
+    chrome_options.add_argument('--no-proxy-server')
+
+    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    chrome_options.add_argument("--disable-extensions")
+    chrome_options.add_experimental_option('useAutomationExtension', False)
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+
+    # Get ready
+    driver_path = '/usr/bin/chromedriver'
+    s = Service(driver_path)
+    driver = webdriver.Chrome(service=s, options=chrome_options)
+
+    # A hung page raises instead of blocking its worker forever
+    driver.set_page_load_timeout(page_load_timeout)
+
+    return driver
+
+
+class DriverPool:
+    # Up to `size` headless browsers shared by all stages. A browser is replaced
+    # after `max_pages` pages, or as soon as it raises a WebDriverException.
+
+    def __init__(self, size=1, max_pages=200, factory=make_driver):
+        self.size = size
+        self.max_pages = max_pages
+        self.factory = factory
+
+        # None is a free slot, a browser gets started for it on demand
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(None)
+
+        self.lock = threading.Lock()
+        self.drivers = {}
+        self.started = 0
+
+    @contextmanager
+    def driver(self):
+        driver = self.acquire()
+        try:
+            yield driver
+        except WebDriverException:
+            self.discard(driver)
+            raise
+        except BaseException:
+            self.release(driver)
+            raise
+        else:
+            self.release(driver)
+
+    def acquire(self):
+        driver = self.idle.get()
+        if driver is None:
+            try:
+                driver = self.factory()
+            except BaseException:
+                self.idle.put(None)
+                raise
+            with self.lock:
+                self.drivers[driver] = 0
+                self.started += 1
+        return driver
+
+    def release(self, driver):
+        with self.lock:
+            self.drivers[driver] += 1
+            recycle = self.drivers[driver] >= self.max_pages
+        if recycle:
+            self.discard(driver)
+        else:
+            self.idle.put(driver)
+
+    def discard(self, driver):
+        with self.lock:
+            self.drivers.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        self.idle.put(None)
+
+    def close(self):
+        with self.lock:
+            drivers = list(self.drivers)
+            self.drivers.clear()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+
+class SeleniumFetcher(Fetcher):
+    name = 'selenium'
+    raw = False
+
+    def __init__(self, mirror=None, record_dir=None, limiter=None, max_retries=5, ready_timeout=3,
+                 browsers=1, max_pages=200):
+        super().__init__(mirror, record_dir, limiter, max_retries)
+        self.ready_timeout = ready_timeout
+        self.pool = DriverPool(browsers, max_pages)
+
+        # One page per browser at a time
+        self.max_workers = browsers
+
+    def _get(self, url, ready=None):
+        with self.pool.driver() as driver:
+            # driver.get() returns once the document has loaded, only wait for
+            # elements that may be rendered later
+            driver.get(url)
+            if ready:
+                try:
+                    WebDriverWait(driver, self.ready_timeout).until(
+                        EC.presence_of_element_located((By.XPATH, ready)))
+                except TimeoutException:
+                    with self.stats_lock:
+                        self.ready_timeouts[host_key(url)] += 1
+            return driver.page_source
+
+    def report(self):
+        super().report()
+        print(f"[{self.name}] {self.pool.started} browsers started")
+
+    def close(self):
+        self.pool.close()
+
+
+class FallbackFetcher(Fetcher):
+    # HTTP first, Selenium only for pages the HTTP client could not get
+    name = 'auto'
+
+    def __init__(self, mirror=None, record_dir=None, limiter=None, max_retries=5, ready_timeout=3,
+                 browsers=1, max_pages=200):
+        super().__init__(None, record_dir, None, 0)
+        self.primary = HttpFetcher(mirror, limiter=limiter, max_retries=max_retries)
+        self.fallback = None
+        self.fallback_args = dict(mirror=mirror, limiter=limiter, max_retries=max_retries,
+                                  ready_timeout=ready_timeout, browsers=browsers, max_pages=max_pages)
+        self.fallback_lock = threading.Lock()
+
+    def _get(self, url, ready=None):
+        try:
+            return self.primary.get(url, ready)
+        except Exception as e:
+            print(f"HTTP fetch failed for {url} ({e}), retrying with Selenium")
+
+        # Browsers are only started once a page needs them
+        with self.fallback_lock:
+            if self.fallback is None:
+                self.fallback = SeleniumFetcher(**self.fallback_args)
+        return self.fallback.get(url, ready)
+
+    def report(self):
+        super().report()
+        self.primary.report()
+        if self.fallback is not None:
+            self.fallback.report()
+
+    def close(self):
+        self.primary.close()
+        if self.fallback is not None:
+            self.fallback.close()
+
+
+FETCHERS = {
+    'http': HttpFetcher,
+    'selenium': SeleniumFetcher,
+    'auto': FallbackFetcher,
+}
+
+
+def parse_rates(text):
+    # "geo=3,pubmed=5" -> {'geo': 3.0, 'pubmed': 5.0, 'pmc': 3.0}
+    rates = dict(DEFAULT_RATES)
+    for item in filter(None, (text or '').split(',')):
+        host, rate = item.split('=')
+        rates[host.strip()] = float(rate)
+    return rates
+
+
+def get_fetcher(backend='http', mirror=None, record_dir=None, rates=None, max_retries=5,
+                ready_timeout=3, browsers=1, max_pages=200):
+    if backend not in FETCHERS:
+        raise ValueError(f"Unknown fetch backend '{backend}', choose from {list(FETCHERS)}")
+    limiter = RateLimiter(DEFAULT_RATES if rates is None else rates)
+
+    options = dict(mirror=mirror, record_dir=record_dir, limiter=limiter, max_retries=max_retries)
+    if backend != 'http':
+        options.update(ready_timeout=ready_timeout, browsers=browsers, max_pages=max_pages)
+
+    return FETCHERS[backend](**options)
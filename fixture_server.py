@@ -0,0 +1,57 @@
+import os
+import sys
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from fetchers import fixture_path
+
+
+# Serves pages saved with `get_methods.py --record [dir]` so that the scrapers
+# can run offline with `--mirror http://127.0.0.1:[port]`.
+def make_handler(fixture_dir):
+
+    class FixtureHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            # /host/path?query -> https://host/path?query
+            url = "https:/" + self.path
+            path = fixture_path(fixture_dir, url)
+
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+
+            with open(path, 'rb') as file:
+                body = file.read()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FixtureHandler
+
+
+def start_fixture_server(fixture_dir, port=0):
+    # Run in a background thread, returns the server and its base URL
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(fixture_dir))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 3:
+        print("Usage: python fixture_server.py [fixture_dir] [port]")
+        exit()
+
+    server = ThreadingHTTPServer(('127.0.0.1', int(sys.argv[2])), make_handler(sys.argv[1]))
+    print(f"\nServing {sys.argv[1]} on http://127.0.0.1:{sys.argv[2]}\n")
+    server.serve_forever()
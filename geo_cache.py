@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import urllib.request
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import GEOparse
+
+from soft_parser import GSE_FIELDS, GSM_FIELDS, parse_soft
+
+
+DEFAULT_GEO_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'scrawler', 'geo')
+
+SOFT_URL = "https://ftp.ncbi.nlm.nih.gov/geo/series/{stub}/{gse_id}/soft/{gse_id}_family.soft.gz"
+
+
+def soft_url(gse_id):
+    # Where GEOparse downloads the family SOFT file of a Series from, e.g. .../GSE1nnn/GSE1234/...
+    stub = f"GSE{gse_id[3:-3]}nnn"
+    return SOFT_URL.format(stub=stub, gse_id=gse_id)
+
+
+def mirror_url(url, mirror):
+    # https://host/path -> {mirror}/host/path, the same layout get_methods.py --mirror uses
+    return f"{mirror.rstrip('/')}/{url.split('://', 1)[1]}"
+
+
+def series_metadata(gse):
+    # {'summary': ..., 'overall_design': ..., 'gsms': {gsm_id: {field: ...}}} of a GEOparse GSE,
+    # every field joined the same way the prompts join them
+    metadata = {field: " ".join(gse.metadata.get(field, [])) for field in GSE_FIELDS}
+    metadata['gsms'] = {
+        gsm_id: {field: " ".join(gsm.metadata.get(field, [])) for field in GSM_FIELDS}
+        for gsm_id, gsm in gse.gsms.items()
+    }
+    return metadata
+
+
+class GEOCache:
+    # Extracted GSE/GSM metadata, one JSON file per Series in `cache_dir`.
+    # Family files are downloaded to a temporary directory and removed right away.
+    # With parser='stream' they are read by soft_parser in `processes` worker
+    # processes (0: in the downloading thread), with parser='geoparse' by GEOparse.
+    # With `mirror`, family files are downloaded from a local fixture or mock server.
+
+    def __init__(self, cache_dir=DEFAULT_GEO_CACHE_DIR, workers=4, processes=None, parser='stream', mirror=None):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.mirror = mirror
+        self.workers = workers
+        self.parser = parser
+        self.lock = threading.Lock()
+
+        if processes is None:
+            processes = min(workers, os.cpu_count() or 1)
+        self.parse_pool = ProcessPoolExecutor(processes) if parser == 'stream' and processes > 0 else None
+
+        # Thread pools of the iter_series generators that are still running
+        self.prefetch_pools = set()
+
+        # Stats
+        self.hits = 0
+        self.downloads = 0
+        self.failed = 0
+        self.download_time = 0.0
+
+    def path(self, gse_id):
+        return os.path.join(self.cache_dir, f"{gse_id}.json")
+
+    def get(self, gse_id):
+        path = self.path(gse_id)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                metadata = json.load(file)
+            with self.lock:
+                self.hits += 1
+            return metadata
+
+        start = time.perf_counter()
+        try:
+            metadata = self.download(gse_id)
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+
+        with self.lock:
+            self.downloads += 1
+            self.download_time += time.perf_counter() - start
+
+        # Write to a temporary name first so a killed run never leaves half a file
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(metadata, file, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+        return metadata
+
+    def download(self, gse_id):
+        destdir = tempfile.mkdtemp(prefix=f"{gse_id}_")
+        try:
+            if self.mirror:
+                filepath = os.path.join(destdir, f"{gse_id}_family.soft.gz")
+                urllib.request.urlretrieve(mirror_url(soft_url(gse_id), self.mirror), filepath)
+                if self.parser == 'geoparse':
+                    return series_metadata(GEOparse.get_GEO(filepath=filepath, silent=True))
+
+            elif self.parser == 'geoparse':
+                gse = GEOparse.get_GEO(geo=gse_id, destdir=destdir, silent=True)
+                return series_metadata(gse)
+
+            else:
+                filepath, _ = GEOparse.get_GEO_file(gse_id, destdir=destdir, silent=True)
+
+            if self.parse_pool is not None:
+                return self.parse_pool.submit(parse_soft, filepath).result()
+            return parse_soft(filepath)
+        finally:
+            shutil.rmtree(destdir, ignore_errors=True)
+
+    def iter_series(self, series_values):
+        # {gse_id: value} -> (gse_id, value, metadata) in the same order. Up to
+        # 2 * workers upcoming Series are fetched in the background while the
+        # current one is being used. Series that cannot be downloaded are skipped.
+        items = iter(series_values.items())
+        pending = deque()
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        with self.lock:
+            self.prefetch_pools.add(pool)
+
+        def submit(item):
+            gse_id, value = item
+            pending.append((gse_id, value, pool.submit(self.get, gse_id)))
+
+        try:
+            for item in islice(items, 2 * self.workers):
+                submit(item)
+
+            while pending:
+                gse_id, value, future = pending.popleft()
+                item = next(items, None)
+                if item is not None:
+                    submit(item)
+
+                try:
+                    metadata = future.result()
+                except Exception as e:
+                    print(f"Error downloading {gse_id}: {e}")
+                    continue
+
+                yield gse_id, value, metadata
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+            with self.lock:
+                self.prefetch_pools.discard(pool)
+
+    def report(self):
+        average = self.download_time / self.downloads if self.downloads else 0.0
+        print(f"[GEO] {self.hits} Series from cache, {self.downloads} downloaded ({average:.1f}s on average), "
+              f"{self.failed} failed")
+
+    def close(self):
+        # Stops the prefetch threads of unfinished iter_series and the parse processes
+        with self.lock:
+            pools, self.prefetch_pools = self.prefetch_pools, set()
+        for pool in pools:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown(cancel_futures=True)
+            self.parse_pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def add_geo_arguments(parser):
+    # Options shared by the scripts that read GSE/GSM metadata
+    parser.add_argument('--geo-cache', default=DEFAULT_GEO_CACHE_DIR,
+                        help=f"Directory of extracted GEO metadata, one JSON file per Series (default: {DEFAULT_GEO_CACHE_DIR})")
+    parser.add_argument('--geo-workers', type=int, default=4,
+                        help="Series downloaded in parallel ahead of the prompts (default: 4)")
+    parser.add_argument('--geo-processes', type=int, default=None,
+                        help="Processes that parse downloaded SOFT files, 0 to parse in the download threads (default: as many as --geo-workers, up to the CPU count)")
+    parser.add_argument('--geo-parser', choices=['stream', 'geoparse'], default='stream',
+                        help="Read only the needed metadata lines (stream) or parse whole files with GEOparse (default: stream)")
+    parser.add_argument('--geo-mirror', default=None,
+                        help="Base URL of a local fixture/mock server to download SOFT files from instead of the GEO FTP site")
+
+
+def geo_from_args(args):
+    return GEOCache(args.geo_cache, workers=args.geo_workers, processes=args.geo_processes, parser=args.geo_parser,
+                    mirror=args.geo_mirror)
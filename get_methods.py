@@ -1,24 +1,48 @@
 import pandas as pd
 import numpy as np
 
-import time
 import re
-import sys
+import json
 import os
 import glob
+import queue
+import argparse
+import threading
 import subprocess
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from tqdm import tqdm
 from math import ceil, floor
 
 from bs4 import BeautifulSoup
 
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.chrome.service import Service
-from selenium.common.exceptions import TimeoutException
+from fetchers import get_fetcher, parse_rates, FETCHERS
+from lookup_cache import LookupCache, DEFAULT_CACHE_PATH, STAGES
+from journal import Journal
+from methods_extract import extract_methods
+from methods_store import write_methods_store
+from jats_source import JATSSource
+
+
+GEO_URL = "https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc={}"
+PUBMED_URL = "https://pubmed.ncbi.nlm.nih.gov/{}"
+PMC_URL = "https://www.ncbi.nlm.nih.gov/pmc/articles/{}/"
+IDCONV_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?tool=scrawler&format=json&ids={}"
+
+# Elements a rendered page must show before it is read
+PUBMED_READY = '//*[@id="full-view-identifiers"]'
+PMC_READY = "//h2[contains(translate(., 'METHOD', 'method'), 'method')]"
+
+# PMIDs per ID converter request (the API accepts up to 200)
+BATCH_SIZE = 200
+
+# Streaming pipeline: items buffered between stages, and seconds to wait for
+# more PMIDs before converting a partial batch
+QUEUE_SIZE = 1000
+LINGER = 2.0
+
+LINK_COLUMNS = ['Series', 'order', 'PMID', 'PMC', 'Method']
 
 
 def read_input(input_filename):
@@ -42,226 +66,515 @@ def read_input(input_filename):
     return df, series_list
 
 
-def get_pmid_list(series_list):
-    # Selenium setting
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument('window-size=1920x1080')
-    chrome_options.add_argument('--headless')
-    chrome_options.add_argument('--no-sandbox')
-    chrome_options.add_argument("--single-process")
-
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--disable-setuid-sandbox')
-    chrome_options.add_argument('--disable-dev-shm-usage')
-    chrome_options.add_argument('--no-proxy-server')
-
-    # Get ready
-    driver_path = '/usr/bin/chromedriver'
-    s = Service(driver_path)
-    driver = webdriver.Chrome(service=s, options=chrome_options)
-
-    base_url = "https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc={}"
-    series_results = {}
-    pmid_list = []
-
-    # Scrape PMID for each GSE
-    for i in tqdm(range(len(series_list))):
-        
-        item = series_list[i]
-        
-        if item not in series_results:  
-            url = base_url.format(item)
-            driver.get(url)
-        
-            t = 5
-            driver.implicitly_wait(t)
-            time.sleep(t)
-
-            citations = driver.find_elements(By.XPATH, "//a[@title='Link to PubMed record']")
-            if citations:
-                citations = [citation.text for citation in citations]
-                series_results[item] = citations  
-            else:
-                series_results[item] = ["None"]
+def parse_pmids(page_html):
+    # PubMed citations on a GEO series page
+    soup = BeautifulSoup(page_html, 'html.parser')
+    citations = soup.find_all('a', title='Link to PubMed record')
+
+    return [citation.get_text(strip=True) for citation in citations]
+
+
+def parse_pmc(page_html):
+    # PMCID in the identifier list of a PubMed record
+    soup = BeautifulSoup(page_html, 'html.parser')
+    element = soup.select_one('#full-view-identifiers > li:nth-of-type(2) > span > a')
+
+    if element:
+        text = element.get_text(strip=True)
+        if text.startswith('PMC'):
+            return text
+
+    return None
+
+
+def parse_methods(page_html):
+    # Text of the Methods section of a PMC article
+    return extract_methods(page_html)
+
 
-        pmid_list.append(series_results[item])
+def crawl(func, items, workers):
+    # Run func over unique items on a worker pool, returns {item: result} in input order
+    results = dict.fromkeys(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(func, item): item for item in results}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            results[futures[future]] = future.result()
 
-    driver.quit()
+    return results
 
-    return pmid_list
 
+def scrape_pmids(fetcher, series):
+    page_html = fetcher.get(GEO_URL.format(series))
 
-def get_pmc_list(pmid_list):
-    # Selenium setting
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument('window-size=1920x1080')
-    chrome_options.add_argument('--headless')
-    chrome_options.add_argument('--no-sandbox')
-    chrome_options.add_argument("--single-process")
+    return parse_pmids(page_html) if page_html else []
 
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--disable-setuid-sandbox')
-    chrome_options.add_argument('--disable-dev-shm-usage')
-    chrome_options.add_argument('--no-proxy-server')
 
-    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-    chrome_options.add_argument("--disable-extensions")
-    chrome_options.add_experimental_option('useAutomationExtension', False)
-    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+def scrape_pmc(fetcher, pmid):
+    page_html = fetcher.get(PUBMED_URL.format(pmid), ready=PUBMED_READY)
+    pmc = parse_pmc(page_html) if page_html else None
 
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36")
+    return pmc if pmc else "None"
 
-    # Get ready
-    driver_path = '/usr/bin/chromedriver'
-    s = Service(driver_path)
-    driver = webdriver.Chrome(service=s, options=chrome_options)
 
-    base_url = "https://pubmed.ncbi.nlm.nih.gov/{}"
-    xpath = '//*[@id="full-view-identifiers"]/li[2]/span/a'
+def scrape_methods(fetcher, pmc):
+    page_html = fetcher.get(PMC_URL.format(pmc), ready=PMC_READY)
+    extracted_text = parse_methods(page_html) if page_html else None
 
-    pmid_results = {}
-    pmc_list = []
-    t = 5
+    return extracted_text if extracted_text else "None"
 
-    # Scrape PMC for each PMID
-    for i in tqdm(range(len(pmid_list))):
-            
-        item = pmid_list[i]
-        
+
+def convert_pmids(fetcher, pmids):
+    # PMID -> PMC for a whole batch with the PMC ID converter
+    body = fetcher.get(IDCONV_URL.format(','.join(pmids)))
+    records = json.loads(body).get('records', []) if body else []
+    found = {str(record.get('pmid')): record['pmcid'] for record in records if record.get('pmcid')}
+
+    return {pmid: found.get(pmid, "None") for pmid in pmids}
+
+
+def lookup(stage, scrape, fetcher, item, cache=None, default="None", failures=None):
+    # Cached result if any, otherwise scrape it. Errors are not cached, but
+    # (stage, item) is added to `failures` (if given) so the caller can tell.
+    if cache is not None:
+        value = cache.get(stage, item)
+        if value is not None:
+            return value
+
+    try:
+        value = scrape(fetcher, item)
+    except Exception as e:
+        print(f"exception for {item} ({stage}): {e}")
+        if failures is not None:
+            failures.add((stage, item))
+        return default
+
+    if cache is not None:
+        cache.set(stage, item, value, found=value != default)
+
+    return value
+
+
+def resolve_pmids(series_list, fetcher, workers=1, cache=None):
+    # Unique GSE -> list of PMIDs
+    return crawl(lambda item: lookup('pmid', scrape_pmids, fetcher, item, cache, []),
+                 series_list, workers)
+
+
+def convert_batch(fetcher, batch, cache=None, failures=None):
+    # PMID -> PMC for one batch of PMIDs, with the ID converter when the fetcher can read it
+    if fetcher.raw:
         try:
-            # If multiple PMIDs
-            item_key = str(item) if isinstance(item, list) else item
-
-            if item_key not in pmid_results:
-                url = base_url.format(item_key)
-                driver.get(url)
-                time.sleep(t)
-                element = driver.find_element(By.XPATH, xpath)
-                            
-                if element:
-                    pmid_results[item_key] = element.text
-                else:
-                    pmid_results[item_key] = "None"
-        
-        except:
-            print('exception for', item)
-            pmid_results[str(item)] = "None"  # List type of item
-
-        pmc_list.append(pmid_results[str(item)])
-
-    driver.quit()
-
-    return pmc_list
-
-
-def get_methods(pmc_list):
-    # Selenium setting
-    chrome_options = webdriver.ChromeOptions()
-    chrome_options.add_argument('window-size=1920x1080')
-    chrome_options.add_argument('--headless')
-    chrome_options.add_argument('--no-sandbox')
-    chrome_options.add_argument("--single-process")
-
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--disable-setuid-sandbox')
-    chrome_options.add_argument('--disable-dev-shm-usage')
-    chrome_options.add_argument('--no-proxy-server')
-
-    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-    chrome_options.add_argument("--disable-extensions")
-    chrome_options.add_experimental_option('useAutomationExtension', False)
-    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36")
-    
-    # Get ready
-    driver_path = '/usr/bin/chromedriver'
-    s = Service(driver_path)
-    driver = webdriver.Chrome(service=s, options=chrome_options)
-
-    base_url = "https://www.ncbi.nlm.nih.gov/pmc/articles/{}/"
-    method_text = []
-    pmc_results = {}
-    crawlcount = 0
-    t = 5
-
-    # Scrape Methods for each PMCs
-    for i in tqdm(range(len(pmc_list))):
-        
-        item = pmc_list[i]
-        
-        if item not in pmc_results:
-            
-            div_content = None
+            results = convert_pmids(fetcher, list(batch))
+        except Exception as e:
+            print(f"exception for PMID batch ({e}), scraping PubMed pages instead")
+        else:
+            if cache is not None:
+                for pmid, pmc in results.items():
+                    cache.set('pmc', pmid, pmc, found=pmc != "None")
+            return results
 
-            try:
-                url = base_url.format(item)    
-                driver.get(url)
-                time.sleep(t)
-                page_html = driver.page_source
-
-                soup = BeautifulSoup(page_html, 'html.parser')            
-                h2_with_text = soup.find('h2', string=lambda text: text and 'method' in text.lower())
-                
-                if h2_with_text:
-                    parent_div = h2_with_text.find_parent('div')
-                    if parent_div and parent_div.has_attr('id'):
-                        div_content = soup.find('div', {'id': parent_div['id']})
-
-                if div_content:
-                    
-                    for tag in div_content.find_all():
-                        tag.append(" ")
-
-                    extracted_text = ' '.join(div_content.get_text().split())
-                    pmc_results[item] = extracted_text
-                else:
-                    pmc_results[item] = "None"      
-                    
-            except:
-                print(f"An error occurred")
-                pmc_results[item] = "None"  
-            
-        # If it's already scraped
-        method_text.append(pmc_results[item])
-
-    driver.quit()
-
-    return method_text
+    # One PubMed page per PMID
+    return {pmid: lookup('pmc', scrape_pmc, fetcher, pmid, cache, failures=failures) for pmid in batch}
 
 
-if __name__ == "__main__":
+def cached_pmcs(pmid_list, cache=None):
+    # Split PMIDs into cached results and PMIDs still to convert
+    results = {}
+    missing = []
+    for pmid in dict.fromkeys(pmid_list):
+        value = cache.get('pmc', pmid) if cache is not None else None
+        if value is None:
+            missing.append(pmid)
+        else:
+            results[pmid] = value
 
-    if len(sys.argv) != 3:
-        print("Usage: python get_methods.py [input_file] [output_file]")
-        exit()
+    return results, missing
 
-    # Read and process input
-    df, series_list = read_input(sys.argv[1])
 
-    # Add PMID
-    pmid_list = get_pmid_list(series_list)
-    pmid_list = [item[0] if len(item) == 1 else item for item in pmid_list]
-    print(f"\nPMIDs for {len(pmid_list)} samples scraped.\n")
-    df['PMID'] = pmid_list
+def resolve_pmcs(pmid_list, fetcher, workers=1, cache=None, batch_size=BATCH_SIZE):
+    # Unique PMID -> PMC
+    results, missing = cached_pmcs(pmid_list, cache)
+
+    batches = [tuple(missing[i:i + batch_size]) for i in range(0, len(missing), batch_size)]
+    for batch_results in crawl(lambda batch: convert_batch(fetcher, batch, cache), batches, workers).values():
+        results.update(batch_results)
+
+    return results
+
+
+def find_methods(fetcher, pmc, cache=None, jats=None, failures=None):
+    # Methods from the local JATS XML if the PMC is there, otherwise from the (cached) PMC page
+    if jats is not None:
+        text = jats.get(pmc)
+        if text:
+            return text
+
+    return lookup('methods', scrape_methods, fetcher, pmc, cache, failures=failures)
+
+
+def resolve_methods(pmc_list, fetcher, workers=1, cache=None, jats=None):
+    # Unique PMC -> Methods text
+    return crawl(lambda item: find_methods(fetcher, item, cache, jats),
+                 pmc_list, workers)
+
+
+def fan_out(df, links):
+    # links has one row per (Series, PMID) with its citation 'order', 'PMC' and 'Method'.
+    # Per Series, take the first cited paper with Methods, else the first with a PMC.
+    links = links.copy()
+    links['rank'] = links['order'] + len(links) * (links['PMC'] == "None") + len(links) * (links['Method'] == "None")
+    chosen = links.sort_values(['Series', 'rank']).groupby('Series').first()
+    pmids = links.sort_values(['Series', 'order']).groupby('Series')['PMID'].agg(';'.join)
+
+    series_df = pd.DataFrame({'PMID': pmids, 'PMC': chosen['PMC'], 'Method': chosen['Method']})
+    df = df.drop(columns=['PMID', 'PMC', 'Method'], errors='ignore')
+    df = df.merge(series_df, left_on='Series', right_index=True, how='left')
+    df[['PMID', 'PMC', 'Method']] = df[['PMID', 'PMC', 'Method']].fillna("None")
+
+    return df
+
+
+def add_methods(df, fetcher, workers=1, cache=None, jats=None):
+    # Resolve unique Series, then unique PMIDs, then unique PMCs, and join back to samples
+    series_list = df['Series'].unique().tolist()
+    print(f"\n{len(series_list)} unique Series.\n")
+    series_pmids = resolve_pmids(series_list, fetcher, workers, cache)
+
+    # One row per (Series, PMID), keeping the citation order
+    links = pd.DataFrame({'Series': list(series_pmids.keys()), 'PMID': list(series_pmids.values())})
+    links = links.explode('PMID').dropna(subset=['PMID'])
+    links = links[links['PMID'] != "None"].drop_duplicates(['Series', 'PMID'])
+    links['order'] = links.groupby('Series').cumcount()
 
-    # Add PMC
-    pmc_list = get_pmc_list(pmid_list)
-    print(f"\nPMCs for {len(set(pmc_list))} samples scraped.\n")
-    df['PMC'] = pmc_list
+    pmid_list = links['PMID'].unique().tolist()
+    print(f"\n{len(pmid_list)} unique PMIDs.\n")
+    pmid_pmcs = resolve_pmcs(pmid_list, fetcher, workers, cache)
+    links['PMC'] = links['PMID'].map(pmid_pmcs).fillna("None")
 
-    # Add Methods
-    df['Method'] = get_methods(pmc_list)
-    print(f"\nMethods for {len(set(pmc_list))} samples scraped.\n")
+    pmc_list = links.loc[links['PMC'] != "None", 'PMC'].unique().tolist()
+    print(f"\n{len(pmc_list)} unique PMCs.\n")
+    pmc_methods = resolve_methods(pmc_list, fetcher, workers, cache, jats)
+    links['Method'] = links['PMC'].map(pmc_methods).fillna("None")
 
-    # Generate output file
-    df.to_csv(sys.argv[2], index=False)
-    print(f"\nYou can check your result in: {sys.argv[2]}\n")
+    return fan_out(df, links)
 
 
+class Memo:
+    # Compute each key once, other threads asking for it wait for the result
 
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = {}
+        self.values = {}
 
+    def get(self, key, func):
+        with self.lock:
+            event = self.events.get(key)
+            owner = event is None
+            if owner:
+                event = self.events[key] = threading.Event()
 
+        if owner:
+            try:
+                self.values[key] = func(key)
+            finally:
+                event.set()
+        else:
+            event.wait()
+
+        return self.values.get(key, "None")
+
+
+def stream_methods(df, fetcher, workers=1, cache=None, on_series=None,
+                   queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, linger=LINGER, jats=None):
+    # Same result as add_methods(), but each Series moves on to the PMC and Methods
+    # stages as soon as its PMIDs are known. on_series(series, links) is called when
+    # a Series is complete and none of its lookups failed, so that a resumed run
+    # does not take a Series whose scrape failed as finished. Returns the samples
+    # and the Series with failed lookups.
+    series_list = df['Series'].unique().tolist()
+    print(f"\n{len(series_list)} unique Series.\n")
+
+    series_q = queue.Queue(maxsize=queue_size)
+    pmid_q = queue.Queue(maxsize=queue_size)
+    pmc_q = queue.Queue(maxsize=queue_size)
+    DONE = object()
+
+    lock = threading.Lock()
+    expected = {}
+    resolved = {}
+    rows = []
+    failures = set()
+    incomplete = []
+    progress = tqdm(total=len(series_list))
+
+    def complete(series, pmid=None, pmc="None", method="None"):
+        # Record one finished (Series, PMID) and emit the Series once all its PMIDs are in
+        with lock:
+            if pmid is not None:
+                resolved[series][pmid] = (pmc, method)
+            if len(resolved[series]) < len(expected[series]):
+                return
+
+            series_rows = [[series, order, p, *resolved[series][p]] for order, p in enumerate(expected[series])]
+            rows.extend(series_rows)
+            progress.update(1)
+
+            # Lookups of this Series that raised instead of finding nothing
+            keys = [('pmid', series)] + [('pmc', p) for p in expected[series]]
+            keys += [('methods', pmc) for pmc, _ in resolved[series].values() if pmc != "None"]
+            if any(key in failures for key in keys):
+                incomplete.append(series)
+            elif on_series is not None:
+                on_series(series, pd.DataFrame(series_rows, columns=LINK_COLUMNS))
+
+    def pmid_worker():
+        while (series := series_q.get()) is not DONE:
+            pmids = lookup('pmid', scrape_pmids, fetcher, series, cache, [], failures)
+            pmids = [pmid for pmid in dict.fromkeys(pmids) if pmid != "None"]
+
+            with lock:
+                expected[series] = pmids
+                resolved[series] = {}
+            if not pmids:
+                complete(series)
+            for pmid in pmids:
+                pmid_q.put((series, pmid))
+
+    def pmc_worker():
+        # Collect PMIDs into batches, flushing when full or idle for `linger` seconds
+        known = {}
+        pending = {}
+        finished = False
+
+        def flush():
+            results, missing = cached_pmcs(list(pending), cache)
+            if missing:
+                results.update(convert_batch(fetcher, missing, cache, failures))
+            known.update(results)
+            for pmid, series_waiting in pending.items():
+                for series in series_waiting:
+                    forward(series, pmid, results.get(pmid, "None"))
+            pending.clear()
+
+        def forward(series, pmid, pmc):
+            if pmc == "None":
+                complete(series, pmid)
+            else:
+                pmc_q.put((series, pmid, pmc))
+
+        while not finished or pending:
+            try:
+                item = pmid_q.get(timeout=linger if pending else None)
+            except queue.Empty:
+                flush()
+                continue
 
+            if item is DONE:
+                finished = True
+            else:
+                series, pmid = item
+                if pmid in known:
+                    forward(series, pmid, known[pmid])
+                    continue
+                pending.setdefault(pmid, []).append(series)
+                if len(pending) < batch_size:
+                    continue
+
+            if pending:
+                flush()
+
+        for _ in range(workers):
+            pmc_q.put(DONE)
+
+    methods_memo = Memo()
+
+    def methods_worker():
+        while (item := pmc_q.get()) is not DONE:
+            series, pmid, pmc = item
+            method = methods_memo.get(pmc, lambda key: find_methods(fetcher, key, cache, jats, failures))
+            complete(series, pmid, pmc, method)
+
+    pmid_threads = [threading.Thread(target=pmid_worker, daemon=True) for _ in range(workers)]
+    pmc_thread = threading.Thread(target=pmc_worker, daemon=True)
+    methods_threads = [threading.Thread(target=methods_worker, daemon=True) for _ in range(workers)]
+    for thread in pmid_threads + [pmc_thread] + methods_threads:
+        thread.start()
+
+    for series in series_list:
+        series_q.put(series)
+    for _ in range(workers):
+        series_q.put(DONE)
+
+    for thread in pmid_threads:
+        thread.join()
+    pmid_q.put(DONE)
+    pmc_thread.join()
+    for thread in methods_threads:
+        thread.join()
+    progress.close()
+
+    if incomplete:
+        print(f"\n{len(incomplete)} Series had failed lookups.\n")
+
+    return fan_out(df, pd.DataFrame(rows, columns=LINK_COLUMNS)), incomplete
+
+
+def journal_writer(df, journal):
+    # Journal the samples of each completed Series as they come in
+    groups = {series: group for series, group in df.groupby('Series')}
+
+    def write(series, links):
+        # fan_out() on a single Series picks the paper the batch run would
+        journal.add_samples(fan_out(groups[series], links).to_dict('records'))
+
+    return write
+
+
+def split_finished(df, journal):
+    # Samples of Series already finished in the journal, and the rest
+    if not journal.samples:
+        return df.iloc[:0], df
+
+    finished = pd.DataFrame(journal.samples).drop_duplicates('Series')[['Series', 'PMID', 'PMC', 'Method']]
+    done = df['Series'].isin(finished['Series'])
+    done_df = df[done].drop(columns=['PMID', 'PMC', 'Method'], errors='ignore').merge(finished, on='Series', how='left')
+
+    return done_df, df[~done]
+
+
+def add_fetch_arguments(parser):
+    # Options of the page fetcher and the lookup cache, shared with pipeline.py.
+    # --max-retries is added by the caller, the LLM options have one as well.
+    parser.add_argument('--backend', choices=list(FETCHERS), default='http',
+                        help="'http' (default), 'selenium' (headless Chrome) or 'auto' (http, Selenium on failure)")
+    parser.add_argument('--mirror', default=None,
+                        help="Base URL of a local fixture/mock server to use instead of NCBI, e.g. http://127.0.0.1:8000")
+    parser.add_argument('--record', default=None,
+                        help="Save every fetched page into this fixture directory")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="Number of pages fetched concurrently (with Selenium, at most one per browser)")
+    parser.add_argument('--ready-timeout', type=float, default=3,
+                        help="Seconds Chrome waits for the PubMed identifiers or the PMC Methods heading (default: 3)")
+    parser.add_argument('--latency-log', default=None,
+                        help="Write the latency of every page to this CSV file")
+    parser.add_argument('--browsers', type=int, default=1,
+                        help="Size of the headless Chrome pool for the selenium and auto backends")
+    parser.add_argument('--browser-max-pages', type=int, default=200,
+                        help="Pages a browser loads before it is restarted")
+    parser.add_argument('--rate-limit', default=None,
+                        help="Requests per second for each host, e.g. geo=3,pubmed=3,pmc=3 (default: 3 each)")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH,
+                        help=f"SQLite cache of previous lookups (default: {DEFAULT_CACHE_PATH})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Scrape everything again and do not store results")
+    parser.add_argument('--cache-ttl', type=float, default=30,
+                        help="Days before a cached lookup is scraped again (default: 30)")
+    parser.add_argument('--cache-negative-ttl', type=float, default=7,
+                        help="Days before a lookup that found nothing is scraped again (default: 7)")
+    parser.add_argument('--refresh', default=None,
+                        help=f"Comma separated stages to drop from the cache before running: {','.join(STAGES)} or all")
+    parser.add_argument('--jats-source', action='append', default=None,
+                        help="Directory or .tar/.tar.gz of PMC JATS XML (e.g. Open Access bulk packages) to read Methods from "
+                             "before scraping PMC, can be given more than once")
+
+
+def fetcher_from_args(args):
+    # (fetcher, number of worker threads)
+    fetcher = get_fetcher(args.backend, mirror=args.mirror, record_dir=args.record,
+                          rates=parse_rates(args.rate_limit), max_retries=args.max_retries,
+                          ready_timeout=args.ready_timeout, browsers=args.browsers,
+                          max_pages=args.browser_max_pages)
+    return fetcher, min(args.workers, fetcher.max_workers or args.workers)
+
+
+def jats_from_args(args):
+    return JATSSource(args.jats_source) if args.jats_source else None
+
+
+def lookup_cache_from_args(args):
+    if args.no_cache:
+        return None
+
+    cache = LookupCache(args.cache, ttl=args.cache_ttl, negative_ttl=args.cache_negative_ttl)
+    for stage in filter(None, (args.refresh or '').split(',')):
+        cache.invalidate(None if stage == 'all' else stage)
+    return cache
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape PMID, PMC and Methods for each GEO series.")
+    parser.add_argument('input_file')
+    parser.add_argument('output_file')
+    add_fetch_arguments(parser)
+    parser.add_argument('--max-retries', type=int, default=5,
+                        help="Retries with exponential backoff on HTTP 429/5xx")
+    parser.add_argument('--staged', action='store_true',
+                        help="Resolve all PMIDs, then all PMCs, then all Methods instead of streaming each Series through")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an interrupted run from its journal instead of starting over")
+    parser.add_argument('--journal', default=None,
+                        help="Directory of the run journal (default: [output_file].journal)")
+    parser.add_argument('--methods-store', default=None,
+                        help="Write Methods text once per PMC to this Parquet file and leave it out of the output CSV")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
 
+    args = parse_args()
 
+    # Read and process input
+    df, _ = read_input(args.input_file)
+
+    fetcher, workers = fetcher_from_args(args)
+    cache = lookup_cache_from_args(args)
+    jats = jats_from_args(args)
+
+    # Every finished lookup and sample is journaled so that the run can be resumed
+    try:
+        journal = Journal(args.journal or f"{args.output_file}.journal", resume=args.resume, cache=cache)
+    except ValueError as e:
+        print(f"\nError! {e}\n")
+        exit()
+    done_df, df = split_finished(df, journal)
+    finished = False
+    incomplete = []
+
+    try:
+        # Add PMID, PMC and Methods
+        if args.staged:
+            df = add_methods(df, fetcher, workers, journal, jats)
+        else:
+            df, incomplete = stream_methods(df, fetcher, workers, journal, on_series=journal_writer(df, journal), jats=jats)
+
+        df = pd.concat([done_df, df]).sort_values(["Series", 'Sample Name'])
+        print(f"\nMethods for {(df['Method'] != 'None').sum()} of {len(df)} samples scraped.\n")
+
+        # Generate output file, with Methods text once per PMC in a separate store if asked
+        if args.methods_store:
+            methods = df[df['PMC'] != "None"].drop_duplicates('PMC').set_index('PMC')['Method'].to_dict()
+            write_methods_store(args.methods_store, methods)
+            df = df.drop(columns=['Method'])
+            print(f"\nMethods of {len(methods)} PMCs written to: {args.methods_store}\n")
+
+        df.to_csv(args.output_file, index=False)
+
+        # The journal is kept while some Series still have to be scraped again
+        finished = not incomplete
+
+    finally:
+        fetcher.report()
+        if args.latency_log:
+            fetcher.write_latencies(args.latency_log)
+        fetcher.close()
+        if jats is not None:
+            jats.report()
+            jats.close()
+        journal.report()
+        journal.close(remove=finished)
+
+    if incomplete:
+        print(f"\n{len(incomplete)} Series had failed lookups, run again with --resume to scrape them again.\n")
+    print(f"\nYou can check your result in: {args.output_file}\n")
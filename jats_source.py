@@ -0,0 +1,248 @@
+import os
+import re
+import json
+import gzip
+import hashlib
+import tarfile
+import threading
+
+try:
+    from lxml import etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+    XML_PARSER = None
+else:
+    XML_PARSER = etree.XMLParser(recover=True, resolve_entities=False, no_network=True, huge_tree=True)
+
+try:
+    import indexed_gzip
+except ImportError:
+    indexed_gzip = None
+
+from methods_extract import subtree_text
+
+
+DEFAULT_JATS_INDEX_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'scrawler', 'jats')
+
+XML_SUFFIXES = ('.xml', '.nxml')
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz')
+GZIP_SUFFIXES = ('.tar.gz', '.tgz')
+
+# PMC OA packages name articles PMC1234567.xml, otherwise the id is read from the article
+PMCID_FILENAME = re.compile(r'(PMC\d+)\.n?xml$', re.I)
+PMCID_ELEMENT = re.compile(rb'<article-id\s+pub-id-type="pmc(?:id|aid)?"\s*>\s*(?:PMC)?(\d+)\s*</article-id>')
+HEAD_SIZE = 16384
+
+
+def article_pmcid(name, head):
+    # PMCID of an article from its file name, or from the first bytes of its XML
+    match = PMCID_FILENAME.search(name)
+    if match:
+        return match.group(1).upper()
+
+    match = PMCID_ELEMENT.search(head)
+    return f"PMC{match.group(1).decode()}" if match else None
+
+
+def section_title(sec):
+    title = sec.find('title')
+    return ''.join(title.itertext()) if title is not None else ''
+
+
+def find_sections(element, match, recurse=True):
+    # Outermost <sec> elements below `element` for which match(sec) is true, in document order
+    found = []
+    for child in element:
+        if child.tag != 'sec':
+            continue
+        if match(child):
+            found.append(child)
+        elif recurse:
+            found += find_sections(child, match)
+
+    return found
+
+
+def jats_methods(xml):
+    # Methods text of a JATS article: the sections with a methods sec-type, or else
+    # the first section with "method" in its title (top level first), as one line
+    # of text like extract_methods gives for the PMC page
+    try:
+        root = etree.fromstring(xml, XML_PARSER) if XML_PARSER is not None else etree.fromstring(xml)
+    except etree.ParseError:
+        return None
+
+    body = root.find('.//body') if root is not None else None
+    if body is None:
+        return None
+
+    def by_type(sec):
+        return 'method' in (sec.get('sec-type') or '').lower()
+
+    def by_title(sec):
+        return 'method' in section_title(sec).lower()
+
+    sections = (find_sections(body, by_type)
+                or find_sections(body, by_title, recurse=False)[:1]
+                or find_sections(body, by_title)[:1])
+
+    pieces = []
+    for sec in sections:
+        subtree_text(sec, pieces)
+        pieces.append(" ")
+
+    return ' '.join(''.join(pieces).split()) or None
+
+
+def index_tar(path):
+    # {pmcid: [path, offset, size]} of the articles in a tarball, read as a stream
+    entries = {}
+    with tarfile.open(path, 'r|*') as tar:
+        for member in tar:
+            if not (member.isfile() and member.name.endswith(XML_SUFFIXES)):
+                continue
+
+            head = b''
+            if not PMCID_FILENAME.search(member.name):
+                head = tar.extractfile(member).read(HEAD_SIZE)
+
+            pmcid = article_pmcid(member.name, head)
+            if pmcid:
+                entries[pmcid] = [path, member.offset_data, member.size]
+
+    return entries
+
+
+def index_xml(path):
+    head = b''
+    if not PMCID_FILENAME.search(path):
+        with open(path, 'rb') as file:
+            head = file.read(HEAD_SIZE)
+
+    pmcid = article_pmcid(path, head)
+    return {pmcid: [path, 0, os.path.getsize(path)]} if pmcid else {}
+
+
+class JATSSource:
+    # Methods of PMC articles from local JATS XML, e.g. a mirror of the PMC Open
+    # Access bulk packages: directories of .xml/.nxml files and .tar/.tar.gz
+    # packages. PMCID -> (file, offset, size) indexes of tarballs are kept in
+    # `index_dir` until the tarball changes, so an article is read with one seek.
+    # Gzipped tarballs are only seekable with indexed_gzip, otherwise they are
+    # decompressed up to the article (fast for PMCs in package order only).
+
+    def __init__(self, paths, index_dir=DEFAULT_JATS_INDEX_DIR):
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.lock = threading.Lock()
+        self.handles = {}
+        self.file_locks = {}
+
+        self.index = {}
+        for path in [paths] if isinstance(paths, str) else paths:
+            self.index.update(self.index_path(path))
+        print(f"\n{len(self.index)} JATS articles indexed.\n")
+
+        # Stats
+        self.found = 0
+        self.missing = 0
+        self.failed = 0
+
+    def index_path(self, path):
+        if os.path.isfile(path):
+            return self.cached_index(path) if path.endswith(TAR_SUFFIXES) else index_xml(path)
+
+        entries = {}
+        for dirpath, _, filenames in os.walk(path):
+            for filename in sorted(filenames):
+                if filename.endswith(TAR_SUFFIXES):
+                    entries.update(self.cached_index(os.path.join(dirpath, filename)))
+                elif filename.endswith(XML_SUFFIXES):
+                    entries.update(index_xml(os.path.join(dirpath, filename)))
+
+        return entries
+
+    def cached_index(self, path):
+        # Index of a tarball, built once per version of the file
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime]
+        index_path = os.path.join(self.index_dir, hashlib.sha256(path.encode('utf-8')).hexdigest()[:16] + '.json')
+
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as file:
+                saved = json.load(file)
+            if saved['path'] == path and saved['stamp'] == stamp:
+                return saved['entries']
+
+        print(f"Indexing {path}")
+        entries = index_tar(path)
+
+        temp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'path': path, 'stamp': stamp, 'entries': entries}, file)
+        os.replace(temp_path, index_path)
+
+        return entries
+
+    def open_gzip(self, path):
+        if indexed_gzip is None:
+            return gzip.open(path, 'rb')
+
+        # The seek points of indexed_gzip are saved next to the tarball index
+        handle = indexed_gzip.IndexedGzipFile(path)
+        seek_points = os.path.join(self.index_dir, hashlib.sha256(path.encode('utf-8')).hexdigest()[:16] + '.gzidx')
+        if os.path.exists(seek_points):
+            handle.import_index(seek_points)
+        else:
+            handle.build_full_index()
+            handle.export_index(seek_points)
+        return handle
+
+    def read(self, path, offset, size):
+        if path.endswith(XML_SUFFIXES):
+            with open(path, 'rb') as file:
+                return file.read()
+
+        if not path.endswith(GZIP_SUFFIXES):
+            with open(path, 'rb') as file:
+                file.seek(offset)
+                return file.read(size)
+
+        # One open handle per gzipped tarball, used by one thread at a time
+        with self.lock:
+            file_lock = self.file_locks.setdefault(path, threading.Lock())
+        with file_lock:
+            if path not in self.handles:
+                self.handles[path] = self.open_gzip(path)
+            handle = self.handles[path]
+            handle.seek(offset)
+            return handle.read(size)
+
+    def get(self, pmc):
+        # Methods text of a PMC, or None if it is not in the local XML or has no Methods
+        entry = self.index.get(pmc)
+        text = None
+        if entry is not None:
+            try:
+                text = jats_methods(self.read(*entry))
+            except (OSError, EOFError, tarfile.TarError) as e:
+                print(f"Could not read {pmc} from {entry[0]}: {e}")
+                with self.lock:
+                    self.failed += 1
+
+        with self.lock:
+            if text:
+                self.found += 1
+            else:
+                self.missing += 1
+        return text
+
+    def report(self):
+        print(f"[JATS] Methods of {self.found} PMCs from local XML, {self.missing} not found there, "
+              f"{self.failed} unreadable")
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
@@ -0,0 +1,111 @@
+import os
+import json
+import threading
+
+from collections import Counter
+
+from lookup_cache import STAGES
+
+
+class Journal:
+    # Append-only record of one get_methods run, so that an interrupted run can
+    # be resumed. Lookups go to {stage}.jsonl, finished samples to samples.jsonl.
+    # Sits in front of the LookupCache (if any) and has the same get/set interface.
+    # Only its own files are ever created or removed, and a non-empty directory
+    # with other files in it is refused.
+
+    def __init__(self, path, resume=False, cache=None):
+        self.path = path
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.names = STAGES + ['samples']
+
+        if os.path.isdir(path):
+            others = [name for name in os.listdir(path) if name not in self.filenames()]
+            if others:
+                raise ValueError(f"{path} is not a journal directory (it has {', '.join(sorted(others)[:3])}), "
+                                 f"choose another --journal")
+        os.makedirs(path, exist_ok=True)
+
+        if not resume:
+            self.remove_files()
+
+        self.results = {stage: {} for stage in STAGES}
+        for stage in STAGES:
+            for record in self.read(stage):
+                self.results[stage][record['key']] = record['value']
+        self.samples = list(self.read('samples'))
+
+        self.files = {name: open(os.path.join(path, f"{name}.jsonl"), 'a', encoding='utf-8')
+                      for name in self.names}
+
+        if resume:
+            print(f"\nResuming from {path}: " + ", ".join(
+                f"{len(self.results[stage])} {stage}" for stage in STAGES) + f", {len(self.samples)} samples\n")
+
+    def filenames(self):
+        return [f"{name}.jsonl" for name in self.names]
+
+    def remove_files(self):
+        for filename in self.filenames():
+            filename = os.path.join(self.path, filename)
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    def read(self, name):
+        filename = os.path.join(self.path, f"{name}.jsonl")
+        if not os.path.isfile(filename):
+            return
+
+        with open(filename, encoding='utf-8') as file:
+            for line in file:
+                # The last line may be cut short by a crash
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def append(self, name, record):
+        with self.lock:
+            file = self.files[name]
+            file.write(json.dumps(record) + '\n')
+            file.flush()
+
+    def get(self, stage, key):
+        key = str(key)
+        if key in self.results[stage]:
+            self.hits[stage] += 1
+            return self.results[stage][key]
+        if self.cache is not None:
+            return self.cache.get(stage, key)
+        return None
+
+    def set(self, stage, key, value, found=True):
+        key = str(key)
+        self.results[stage][key] = value
+        self.append(stage, {'key': key, 'value': value})
+        if self.cache is not None:
+            self.cache.set(stage, key, value, found)
+
+    def add_samples(self, rows):
+        # rows: list of dicts, one per finished sample
+        for row in rows:
+            self.append('samples', row)
+
+    def report(self):
+        if sum(self.hits.values()):
+            print("\nResumed from journal: " + ", ".join(f"{stage}: {self.hits[stage]}" for stage in STAGES))
+        if self.cache is not None:
+            self.cache.report()
+
+    def close(self, remove=False):
+        for file in self.files.values():
+            file.close()
+        if self.cache is not None:
+            self.cache.close()
+        if remove:
+            self.remove_files()
+            # The directory goes too if nothing else was put in it since
+            if not os.listdir(self.path):
+                os.rmdir(self.path)
@@ -0,0 +1,4 @@
+def percentiles(values, qs):
+    # Nearest-rank percentiles, the same for page and LLM request latencies
+    values = sorted(values)
+    return [values[min(len(values) - 1, int(len(values) * q / 100))] for q in qs]
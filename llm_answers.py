@@ -0,0 +1,65 @@
+import json
+
+
+# Replies that could not be read get one more turn with this message
+REASK_MESSAGE = ("Your answer could not be read. Answer again in exactly the format asked for above, "
+                 "with every requested key and nothing else.")
+
+JSON_OBJECT = {'type': 'json_object'}
+
+
+def parse_json_object(answer):
+    # The outermost {...} of an answer, also inside ```json fences or after some
+    # text. None if there is no valid JSON object.
+    if not isinstance(answer, str):
+        return None
+
+    start = answer.find('{')
+    end = answer.rfind('}')
+    if start == -1 or end < start:
+        return None
+
+    try:
+        parsed = json.loads(answer[start:end + 1])
+    except ValueError:
+        return None
+
+    return parsed if isinstance(parsed, dict) else None
+
+
+def parse_key_values(answer):
+    # "Key: value" lines, split at the first colon. Other lines are skipped.
+    result = {}
+    for line in answer.splitlines():
+        key, colon, value = line.partition(':')
+        if colon:
+            result[key.strip().strip('-*#` ').strip()] = value.strip()
+
+    return result
+
+
+def check_fields(result, fields):
+    # {field: value} with exactly the expected fields (matched case-insensitively),
+    # or None if result is not a dict or a field is missing. null becomes "nan".
+    if not isinstance(result, dict):
+        return None
+
+    by_key = {str(key).strip().lower(): value for key, value in result.items()}
+    if not all(field.lower() in by_key for field in fields):
+        return None
+
+    values = {field: by_key[field.lower()] for field in fields}
+    return {field: "nan" if value is None else str(value).strip() for field, value in values.items()}
+
+
+def parse_answer(answer, fields):
+    # Fields of a JSON answer, or of "Key: value" lines for older prompts.
+    # None for "Error" and for answers without every field, never exits.
+    if not isinstance(answer, str) or answer == "Error":
+        return None
+
+    result = parse_json_object(answer)
+    if result is None:
+        result = parse_key_values(answer)
+
+    return check_fields(result, fields)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import tempfile
+
+from openai import OpenAI
+
+from llm_cache import chat_request
+from llm_answers import REASK_MESSAGE
+
+
+# The Batch API takes up to 50,000 requests and 200 MB per input file
+MAX_BATCH_REQUESTS = 50000
+MAX_BATCH_BYTES = 190 * 1024 * 1024
+
+FINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+class BatchRunner:
+    # Same interface as LLMEngine, but all prompts go through the OpenAI Batch API:
+    # they are written to JSONL files, submitted, polled until done, and the rows
+    # that failed are submitted again (up to `max_rounds` times in total).
+
+    def __init__(self, api_key, model, base_url=None, poll_interval=60, max_rounds=3,
+                 temperature=0, cache=None):
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.cache = cache
+        self.model = model
+        self.temperature = temperature
+        self.poll_interval = poll_interval
+        self.max_rounds = max_rounds
+        self.params = {}
+
+        # Stats
+        self.requests = 0
+        self.errors = 0
+        self.invalid = 0
+        self.batches = 0
+        self.elapsed = 0.0
+
+    def run(self, jobs, on_result, valid=None, response_format=None):
+        # jobs: iterable of (key, messages), on_result(key, answer) in the order of jobs
+        # valid(key, answer): answers it rejects are neither cached nor taken from the cache,
+        # and are submitted again in the next round with a follow-up turn asking to fix them
+        start = time.perf_counter()
+        self.params = {'response_format': response_format} if response_format else {}
+
+        jobs = list(jobs)
+        messages = [job_messages for _, job_messages in jobs]
+        answers = {}
+        unreadable = {}
+        pending = list(range(len(jobs)))
+
+        def is_valid(index, answer):
+            return valid is None or valid(jobs[index][0], answer)
+
+        # Only prompts that were never answered before go into a batch
+        if self.cache is not None:
+            for index in pending:
+                answer = self.cache.get(self.request(messages[index]))
+                if answer is not None and is_valid(index, answer):
+                    answers[index] = answer
+            pending = [index for index in pending if index not in answers]
+
+        for round_number in range(1, self.max_rounds + 1):
+            if not pending:
+                break
+            print(f"\nBatch round {round_number}: {len(pending)} requests\n")
+
+            lines = [self.request_line(index, messages[index]) for index in pending]
+            batch_ids = [self.submit(chunk) for chunk in chunked(lines)]
+            for batch_id in batch_ids:
+                for index, answer in self.collect(self.wait(batch_id)).items():
+                    if not is_valid(index, answer):
+                        unreadable[index] = answer
+                        messages[index] = messages[index] + [
+                            {"role": "assistant", "content": answer},
+                            {"role": "user", "content": REASK_MESSAGE},
+                        ]
+                        continue
+
+                    answers[index] = answer
+                    unreadable.pop(index, None)
+                    if self.cache is not None:
+                        self.cache.put(self.request(messages[index]), answer)
+
+            pending = [index for index in pending if index not in answers]
+            if pending:
+                print(f"{len(pending)} requests failed or could not be read in round {round_number}")
+
+        self.errors += len(pending) - len(unreadable)
+        self.invalid += len(unreadable)
+        for index, (key, _) in enumerate(jobs):
+            on_result(key, answers.get(index, unreadable.get(index, "Error")))
+
+        self.elapsed += time.perf_counter() - start
+
+    def request(self, messages):
+        return chat_request(self.model, messages, self.temperature, **self.params)
+
+    def request_line(self, index, messages):
+        return json.dumps({
+            'custom_id': str(index),
+            'method': 'POST',
+            'url': '/v1/chat/completions',
+            'body': self.request(messages),
+        }) + '\n'
+
+    def submit(self, lines):
+        # Write one JSONL request per prompt and start a batch
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False, encoding='utf-8') as file:
+            file.writelines(lines)
+            path = file.name
+
+        try:
+            with open(path, 'rb') as file:
+                input_file = self.client.files.create(file=file, purpose='batch')
+        finally:
+            os.remove(path)
+
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h',
+        )
+        self.requests += len(lines)
+        self.batches += 1
+        print(f"Submitted batch {batch.id} ({len(lines)} requests)")
+
+        return batch.id
+
+    def wait(self, batch_id):
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in FINAL_STATUSES:
+                print(f"Batch {batch_id} {batch.status}")
+                return batch
+
+            counts = batch.request_counts
+            if counts is not None:
+                print(f"Batch {batch_id} {batch.status}: {counts.completed}/{counts.total} done, {counts.failed} failed")
+            time.sleep(self.poll_interval)
+
+    def collect(self, batch):
+        # {index: answer} for the requests that succeeded
+        answers = {}
+        if not batch.output_file_id:
+            return answers
+
+        for line in self.client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get('response') or {}
+            if record.get('error') or response.get('status_code') != 200:
+                continue
+            answer = response['body']['choices'][0]['message']['content']
+            if answer is not None:
+                answers[int(record['custom_id'])] = answer
+
+        return answers
+
+    def report(self):
+        print(f"\n[Batch] {self.requests} requests in {self.batches} batches, {self.elapsed:.1f}s, "
+              f"{self.errors} failed, {self.invalid} unreadable")
+        if self.cache is not None:
+            self.cache.report()
+        print()
+
+
+def chunked(lines):
+    # Split request lines into input files within the Batch API limits
+    chunk, size = [], 0
+    for line in lines:
+        line_size = len(line.encode('utf-8'))
+        if chunk and (len(chunk) == MAX_BATCH_REQUESTS or size + line_size > MAX_BATCH_BYTES):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(line)
+        size += line_size
+    if chunk:
+        yield chunk
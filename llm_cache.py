@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+DEFAULT_LLM_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'scrawler', 'llm.sqlite')
+
+
+def chat_request(model, messages, temperature=0, **params):
+    # Arguments of one chat completion, also what the cache is keyed by
+    return {'model': model, 'messages': messages, 'temperature': temperature, **params}
+
+
+def request_key(request):
+    # Hash of the model, the parameters and the full message list
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    # Persistent chat completion cache shared by classify, annotate and neaten.
+    # Least recently used answers are evicted once the stored text exceeds `max_mb`.
+
+    def __init__(self, path=DEFAULT_LLM_CACHE_PATH, max_mb=2048):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.max_bytes = max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, request):
+        key = request_key(request)
+        with self.lock:
+            row = self.conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0]
+
+    def put(self, request, response):
+        key = request_key(request)
+        size = len(response.encode('utf-8'))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.total_bytes += size - (old[0] if old else 0)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            if self.total_bytes <= self.max_bytes:
+                return
+
+            # Drop the least recently used answers until 90% of the limit is left
+            keys = []
+            for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+                if self.total_bytes <= 0.9 * self.max_bytes:
+                    break
+                keys.append((key,))
+                self.total_bytes -= size
+
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+            self.conn.commit()
+            self.evicted += len(keys)
+
+    def report(self):
+        total = self.hits + self.misses
+        if total:
+            print(f"[LLM cache] {self.hits}/{total} hits ({100 * self.hits / total:.1f}%), {self.evicted} evicted")
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,278 @@
+import re
+import csv
+import time
+import asyncio
+
+import openai
+from openai import AsyncOpenAI
+
+from llm_batch import BatchRunner
+from llm_cache import LLMCache, DEFAULT_LLM_CACHE_PATH, chat_request
+from llm_answers import REASK_MESSAGE
+from latencies import percentiles
+from retries import parse_retry_after, backoff_delay
+
+
+# gpt_model = 'gpt-3.5-turbo'
+GPT_MODEL = 'gpt-4-0125-preview'
+
+# Errors worth sending the same request again for
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+def parse_reset(value):
+    # "6m0s", "1.5s", "20ms" -> seconds
+    if not value:
+        return None
+    seconds = 0.0
+    for number, unit in re.findall(r'([\d.]+)(ms|s|m|h)', value):
+        seconds += float(number) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return seconds
+
+
+def retry_delay(error, attempt):
+    # Retry-After if the server sent a readable one, else exponential backoff with full jitter
+    response = getattr(error, 'response', None)
+    retry_after = parse_retry_after(response.headers.get('retry-after')) if response is not None else None
+    return retry_after if retry_after is not None else backoff_delay(attempt)
+
+
+class LLMEngine:
+    # Sends chat completions concurrently and hands the answers back in job order.
+    # The number of requests in flight starts at `concurrency`, is halved on every
+    # 429 and grows back by one per `concurrency` successful requests. When the
+    # rate-limit headers say the budget is used up, new requests wait for the reset.
+
+    def __init__(self, api_key, model=GPT_MODEL, base_url=None, concurrency=8, max_retries=6,
+                 temperature=0, cache=None, max_reasks=2, latency_log=None):
+        self.api_key = api_key
+        self.cache = cache
+        self.base_url = base_url
+        self.model = model
+        self.temperature = temperature
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.max_reasks = max_reasks
+        self.latency_log = latency_log
+        self.valid = None
+        self.params = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        # Stats of one run(), so that each script or pipeline stage reports its own
+        self.requests = 0
+        self.retries = 0
+        self.reasks = 0
+        self.invalid = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.elapsed = 0.0
+        self.latencies = []
+        if self.cache is not None:
+            self.cache.reset_stats()
+
+    def run(self, jobs, on_result, valid=None, response_format=None):
+        # jobs: iterable of (key, messages), may block (e.g. while downloading from GEO)
+        # on_result(key, answer) is called in the order of jobs, answer is "Error" on failure
+        # valid(key, answer): answers it rejects are asked again up to `max_reasks` times,
+        # and are neither cached nor taken from the cache
+        # response_format: e.g. {'type': 'json_object'} for prompts that ask for JSON
+        self.valid = valid
+        self.params = {'response_format': response_format} if response_format else {}
+        self.reset_stats()
+        start = time.perf_counter()
+        asyncio.run(self._run(jobs, on_result))
+        self.elapsed += time.perf_counter() - start
+
+    async def _run(self, jobs, on_result):
+        self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        self.limit = float(self.concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.slots = asyncio.Condition()
+
+        done = object()
+        jobs = iter(jobs)
+        results = {}
+        next_to_write = 0
+        tasks = set()
+
+        async def handle(index, key, messages):
+            nonlocal next_to_write
+            try:
+                results[index] = (key, await self.ask(key, messages))
+            finally:
+                async with self.slots:
+                    self.in_flight -= 1
+                    self.slots.notify_all()
+
+            # Write in order
+            while next_to_write in results:
+                on_result(*results.pop(next_to_write))
+                next_to_write += 1
+
+        index = 0
+        while True:
+            async with self.slots:
+                await self.slots.wait_for(lambda: self.in_flight < max(1, int(self.limit)))
+                self.in_flight += 1
+
+            job = await asyncio.to_thread(next, jobs, done)
+            if job is done:
+                async with self.slots:
+                    self.in_flight -= 1
+                break
+
+            key, messages = job
+            task = asyncio.create_task(handle(index, key, messages))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            index += 1
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        await self.client.close()
+
+    async def ask(self, key, messages):
+        # Answers that cannot be read get a follow-up turn instead of a full rerun
+        for reask in range(self.max_reasks + 1):
+            answer = await self.complete(key, messages)
+            if answer == "Error" or self.is_valid(key, answer):
+                return answer
+
+            if reask < self.max_reasks:
+                self.reasks += 1
+                messages = messages + [
+                    {"role": "assistant", "content": answer or ""},
+                    {"role": "user", "content": REASK_MESSAGE},
+                ]
+
+        print(f"Could not read the answer for {key}: {answer!r}")
+        self.invalid += 1
+        return answer
+
+    async def complete(self, key, messages):
+        request = chat_request(self.model, messages, self.temperature, **self.params)
+        if self.cache is not None:
+            answer = self.cache.get(request)
+            if answer is not None and self.is_valid(key, answer):
+                return answer
+
+        # Latency of an answer includes its retries and waits
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            # Wait out an exhausted rate-limit window
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                self.requests += 1
+                raw = await self.client.chat.completions.with_raw_response.create(**request)
+                self.read_headers(raw.headers)
+                answer = raw.parse().choices[0].message.content
+
+                # Additive increase
+                self.limit = min(self.concurrency, self.limit + 1 / max(self.limit, 1))
+                self.latencies.append(time.perf_counter() - start)
+
+                if self.cache is not None and answer is not None and self.is_valid(key, answer):
+                    self.cache.put(request, answer)
+                return answer
+
+            except RETRYABLE_ERRORS as e:
+                if isinstance(e, openai.RateLimitError):
+                    # Multiplicative decrease
+                    self.rate_limited += 1
+                    self.limit = max(1.0, self.limit / 2)
+
+                if attempt == self.max_retries:
+                    print(f"Error processing {key}: giving up after {attempt + 1} attempts ({e})")
+                    break
+
+                self.retries += 1
+                await asyncio.sleep(retry_delay(e, attempt))
+
+            except Exception as e:
+                print(f"Error processing {key}: {e}")
+                break
+
+        self.errors += 1
+        return "Error"
+
+    def is_valid(self, key, answer):
+        return self.valid is None or self.valid(key, answer)
+
+    def read_headers(self, headers):
+        # Pause new requests when the request or token budget is nearly used up
+        for kind in ['requests', 'tokens']:
+            remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+            reset = parse_reset(headers.get(f'x-ratelimit-reset-{kind}'))
+            if remaining is None or reset is None:
+                continue
+
+            low = self.in_flight if kind == 'requests' else 0
+            if int(float(remaining)) <= low:
+                self.paused_until = max(self.paused_until, time.monotonic() + reset)
+
+    def report(self):
+        rate = self.requests / self.elapsed if self.elapsed else 0.0
+        print(f"\n[LLM] {self.requests} requests in {self.elapsed:.1f}s ({rate:.2f} req/sec), "
+              f"{self.retries} retries, {self.rate_limited} rate limited, {self.errors} failed, "
+              f"{self.reasks} re-asked, {self.invalid} unreadable")
+        if self.latencies:
+            p50, p90, p99 = percentiles(self.latencies, [50, 90, 99])
+            print(f"[LLM] latency p50 {p50:.2f}s, p90 {p90:.2f}s, p99 {p99:.2f}s, max {max(self.latencies):.2f}s")
+        if self.latency_log:
+            self.write_latencies(self.latency_log)
+        if self.cache is not None:
+            self.cache.report()
+        print()
+
+    def write_latencies(self, filename):
+        with open(filename, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['host', 'seconds'])
+            writer.writerows(['llm', f"{latency:.4f}"] for latency in self.latencies)
+
+
+def add_llm_arguments(parser):
+    # Options shared by the scripts that call the OpenAI API
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="Maximum number of requests in flight (default: 8)")
+    parser.add_argument('--base-url', default=None,
+                        help="OpenAI-compatible endpoint, e.g. a local mock server")
+    parser.add_argument('--max-retries', type=int, default=6,
+                        help="Retries with backoff on 429, 5xx and connection errors")
+    parser.add_argument('--reasks', type=int, default=2,
+                        help="Follow-up questions for an answer that cannot be read (default: 2)")
+    parser.add_argument('--llm-latency-log', default=None,
+                        help="Write the latency of every answered request to this CSV file")
+    parser.add_argument('--llm-cache', default=DEFAULT_LLM_CACHE_PATH,
+                        help=f"SQLite cache of previous answers (default: {DEFAULT_LLM_CACHE_PATH})")
+    parser.add_argument('--no-llm-cache', action='store_true',
+                        help="Ask again even if the same prompt was answered before")
+    parser.add_argument('--llm-cache-size', type=float, default=2048,
+                        help="MB of answers kept before the least recently used are evicted (default: 2048)")
+    parser.add_argument('--batch', action='store_true',
+                        help="Send all prompts through the OpenAI Batch API (half price, results within 24h)")
+    parser.add_argument('--batch-poll-interval', type=float, default=60,
+                        help="Seconds between batch status checks (default: 60)")
+    parser.add_argument('--batch-rounds', type=int, default=3,
+                        help="Times failed batch requests are submitted again, counting the first (default: 3)")
+
+
+def engine_from_args(api_key, args):
+    cache = None if args.no_llm_cache else LLMCache(args.llm_cache, max_mb=args.llm_cache_size)
+
+    if args.batch:
+        return BatchRunner(api_key, GPT_MODEL, base_url=args.base_url, poll_interval=args.batch_poll_interval,
+                           max_rounds=args.batch_rounds, cache=cache)
+    return LLMEngine(api_key, base_url=args.base_url, concurrency=args.concurrency,
+                     max_retries=args.max_retries, cache=cache, max_reasks=args.reasks,
+                     latency_log=args.llm_latency_log)
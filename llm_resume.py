@@ -0,0 +1,38 @@
+import os
+import csv
+
+import pandas as pd
+
+
+def read_done(output_filename, columns, is_done):
+    # Rows of an earlier run's output that are done, as a DataFrame with `columns`.
+    # is_done(frame) -> boolean Series, e.g. rows without "Error".
+    if not os.path.exists(output_filename):
+        return pd.DataFrame(columns=columns)
+
+    previous = pd.read_csv(output_filename, dtype=str, keep_default_na=False)
+    if not set(columns) <= set(previous.columns):
+        print(f"{output_filename} does not have the columns {columns}, starting over")
+        return pd.DataFrame(columns=columns)
+
+    previous = previous[columns].drop_duplicates('Sample Name', keep='last')
+    return previous[is_done(previous)]
+
+
+def write_done(output_filename, columns, done):
+    # Start the output over with only the rows that are done, answers are appended after them
+    with open(output_filename, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerows(done[columns].itertuples(index=False, name=None))
+
+
+def start_output(output_filename, columns, resume=False, is_done=None):
+    # Header of a fresh output, or with resume the rows that are done from an
+    # earlier run. Returns the Sample Names that do not need to be asked again.
+    done = read_done(output_filename, columns, is_done) if resume else pd.DataFrame(columns=columns)
+    write_done(output_filename, columns, done)
+
+    if resume:
+        print(f"Resuming {output_filename}: {len(done)} samples already done")
+    return set(done['Sample Name'])
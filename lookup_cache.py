@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from collections import Counter
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'scrawler', 'lookups.sqlite')
+
+# GSE -> PMIDs, PMID -> PMC, PMC -> Methods
+STAGES = ['pmid', 'pmc', 'methods']
+
+
+class LookupCache:
+    # Persistent accession -> result cache shared by all get_methods stages.
+    # Lookups that found nothing expire after `negative_ttl` days, because
+    # GEO series and PubMed records get linked to papers later on.
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=30, negative_ttl=7):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.ttl = ttl * 86400
+        self.negative_ttl = negative_ttl * 86400
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS lookups (
+                stage TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                found INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (stage, key)
+            )
+        """)
+        self.conn.commit()
+
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, stage, key):
+        # Cached value, None if missing or expired
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, found, fetched_at FROM lookups WHERE stage = ? AND key = ?",
+                (stage, str(key)),
+            ).fetchone()
+
+            if row is not None:
+                value, found, fetched_at = row
+                ttl = self.ttl if found else self.negative_ttl
+                if time.time() - fetched_at <= ttl:
+                    self.hits[stage] += 1
+                    return json.loads(value)
+
+            self.misses[stage] += 1
+            return None
+
+    def set(self, stage, key, value, found=True):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO lookups (stage, key, value, found, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (stage, str(key), json.dumps(value), int(found), time.time()),
+            )
+            self.conn.commit()
+
+    def invalidate(self, stage=None, keys=None):
+        # Drop a whole stage, some keys of a stage, or everything
+        with self.lock:
+            if stage is None:
+                self.conn.execute("DELETE FROM lookups")
+            elif keys is None:
+                self.conn.execute("DELETE FROM lookups WHERE stage = ?", (stage,))
+            else:
+                self.conn.executemany(
+                    "DELETE FROM lookups WHERE stage = ? AND key = ?",
+                    [(stage, str(key)) for key in keys],
+                )
+            self.conn.commit()
+
+    def report(self):
+        print("\nCache hits:")
+        for stage in STAGES:
+            total = self.hits[stage] + self.misses[stage]
+            if total:
+                print(f"  {stage}: {self.hits[stage]}/{total} ({100 * self.hits[stage] / total:.1f}%)")
+
+    def close(self):
+        self.conn.close()
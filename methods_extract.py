@@ -0,0 +1,91 @@
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+
+# Text inside these tags is not part of get_text() in BeautifulSoup either
+SKIP_TAGS = {'script', 'style', 'template'}
+
+
+def extract_methods_bs4(page_html):
+    # Reference implementation: whole page through html.parser
+    div_content = None
+
+    soup = BeautifulSoup(page_html, 'html.parser')
+    h2_with_text = soup.find('h2', string=lambda text: text and 'method' in text.lower())
+
+    if h2_with_text:
+        parent_div = h2_with_text.find_parent('div')
+        if parent_div and parent_div.has_attr('id'):
+            div_content = soup.find('div', {'id': parent_div['id']})
+
+    if div_content:
+
+        for tag in div_content.find_all():
+            tag.append(" ")
+
+        return ' '.join(div_content.get_text().split())
+
+    return None
+
+
+def single_string(element):
+    # Same as BeautifulSoup's Tag.string: the text of an element with exactly one child
+    children = list(element)
+    count = len(children) + bool(element.text) + sum(bool(child.tail) for child in children)
+    if count != 1:
+        return None
+
+    if element.text:
+        return element.text
+    if children[0].tag is etree.Comment:
+        return children[0].text
+    return single_string(children[0])
+
+
+def subtree_text(element, pieces):
+    # Text of the subtree, with a space after the content of every element
+    if element.text:
+        pieces.append(element.text)
+
+    for child in element:
+        if isinstance(child.tag, str):
+            # Skipped elements lose their text but still end with the separator, as in bs4
+            if child.tag not in SKIP_TAGS:
+                subtree_text(child, pieces)
+            pieces.append(" ")
+        if child.tail:
+            pieces.append(child.tail)
+
+    return pieces
+
+
+def extract_methods_lxml(page_html):
+    # Parse with lxml and only walk the Methods div
+    try:
+        root = lxml.html.fromstring(page_html)
+    except ValueError:
+        # Unicode string with an encoding declaration
+        root = lxml.html.fromstring(page_html.encode('utf-8'))
+
+    for h2 in root.iter('h2'):
+        text = single_string(h2)
+        if not (text and 'method' in text.lower()):
+            continue
+
+        # Only the first matching heading counts
+        parent_div = next(h2.iterancestors('div'), None)
+        if parent_div is None or parent_div.get('id') is None:
+            return None
+
+        div_content = root.xpath('//div[@id=$id]', id=parent_div.get('id'))[0]
+        return ' '.join(''.join(subtree_text(div_content, [])).split()) or None
+
+    return None
+
+
+extract_methods = extract_methods_lxml if lxml is not None else extract_methods_bs4
@@ -0,0 +1,66 @@
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# Methods text is stored once per PMC in a zstd-compressed Parquet file, and the
+# sample sheets only keep the PMC column.
+def write_methods_store(path, methods, compression='zstd'):
+    # methods: {PMC: Methods text}
+    if pq is None:
+        raise ImportError("pyarrow is needed for the compact Methods store: pip install pyarrow")
+
+    pmcs = sorted(pmc for pmc in methods if pmc != "None")
+    table = pa.table({'PMC': pmcs, 'Method': [methods[pmc] for pmc in pmcs]})
+    pq.write_table(table, path, compression=compression, row_group_size=1000)
+
+
+class MethodsStore:
+    # Nothing is read until the first lookup, and then only the PMCs asked for
+
+    def __init__(self, path, pmcs=None):
+        if pq is None:
+            raise ImportError("pyarrow is needed for the compact Methods store: pip install pyarrow")
+        self.path = path
+        self.pmcs = None if pmcs is None else sorted(set(pmcs) - {"None"})
+        self.methods = None
+
+    def load(self):
+        filters = None if self.pmcs is None else [('PMC', 'in', self.pmcs)]
+        table = pq.read_table(self.path, columns=['PMC', 'Method'], filters=filters)
+        self.methods = dict(zip(table.column('PMC').to_pylist(), table.column('Method').to_pylist()))
+
+    def get(self, pmc):
+        if self.methods is None:
+            self.load()
+        return self.methods.get(pmc, "None")
+
+
+class SeriesMethods:
+    # Series -> Methods text, read from the store when it is first asked for
+
+    def __init__(self, series_pmc, store):
+        self.series_pmc = series_pmc
+        self.store = store
+
+    def __len__(self):
+        return len(self.series_pmc)
+
+    def __getitem__(self, series):
+        return self.store.get(self.series_pmc[series])
+
+    def items(self):
+        for series, pmc in self.series_pmc.items():
+            yield series, self.store.get(pmc)
+
+
+def series_methods(df, store_path=None):
+    # Series -> Methods text, from the 'Method' column or else from the store by 'PMC'
+    if 'Method' in df.columns:
+        return df.groupby('Series')['Method'].first().to_dict()
+
+    series_pmc = df['PMC'].fillna("None").astype(str).groupby(df['Series']).first().to_dict()
+    return SeriesMethods(series_pmc, MethodsStore(store_path, series_pmc.values()))
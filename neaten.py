@@ -1,10 +1,16 @@
+import argparse
+
 import pandas as pd
 import numpy as np
-import sys
 
-from tqdm import tqdm
+from llm_engine import LLMEngine, add_llm_arguments, engine_from_args
+from llm_answers import JSON_OBJECT, parse_json_object, parse_key_values
+from prompt_pack import chunked
+from term_matcher import TermMatcher
+from vocab_store import add_vocab_arguments, vocab_from_args
+from term_lists import DISEASE_LIST_PATH, CANCER_LIST_PATH, ORGAN_LIST_PATH, file_version
 
-from openai import OpenAI
+OUTPUT_COLUMNS = ['Series', 'Sample Name', 'Organ', 'Healthy', 'Disease', 'Cancer_Type', 'Cancer_Tissue', 'Age', 'Sex']
 
 
 def read_input(input_filename):
@@ -19,54 +25,83 @@ def read_input(input_filename):
     return df
 
 
-def answer_to_dict(answer):
-    result_dict = {}
-    
-    answers = [x for x in answer.split("\n") if len(x) > 0]
-
-    for line in answers:
-        # remove whitespace
-        pair = line.strip()
-
-        # split
-        try:
-            key, value = pair.split(":")
-        except:
-            print("Something went wrong while formatting GPT output.")
-            print("Output looks like this:")
-            print(answer)
-            exit()
-
-        # remove whitespace
-        key = key.strip()
-        value = value.strip()
-
-        result_dict[key] = value
-    
-    return result_dict
+def parse_mapping(answer):
+    # {word in A: word in B} from a JSON answer, or from "word in A: word in B" lines
+    return parse_json_object(answer) or parse_key_values(answer or "")
+
+
+def known_terms(vocabulary, version, terms, target_words, fuzzy_cutoff=100, store=None):
+    # ({term: target}, unresolved terms, {unresolved term: close targets}): mappings
+    # from the store first, then exact, normalized and (if turned on) fuzzy matches.
+    # Local matches are made again on every run and are not added to the store,
+    # so a fuzzy guess is never taken for a learned mapping.
+    mapping = store.lookup(vocabulary, version, terms) if store is not None else {}
+
+    matcher = TermMatcher(target_words, fuzzy_cutoff, vocabulary)
+    matched, fuzzy, unresolved = matcher.match([term for term in terms if term not in mapping])
+    matcher.report()
+
+    mapping.update(matched)
+    mapping.update(fuzzy)
 
+    return mapping, unresolved, matcher.hints(unresolved)
 
-def neaten_up(api_key, df):
+
+def neaten_up(api_key, df, engine=None, chunk_size=200, fuzzy_cutoff=100, store=None):
     # Disease term list
-    dis = pd.read_csv("/home/smcheong/SCraper/Disease_list.csv")
+    dis = pd.read_csv(DISEASE_LIST_PATH)
     disease_list = dis['Disease_Cancer'].tolist()
 
     # unorganized words -> target words
     target_words = disease_list
     unorganized_words = sorted(set(df[~df['Disease'].isna()]['Disease']))
 
-    # GPT
-    client = OpenAI(
-        api_key=api_key,
-    )
-
-    assert unorganized_words
     assert target_words
-    assert client
 
-    # gpt_model = 'gpt-3.5-turbo'
-    gpt_model = 'gpt-4-0125-preview'
+    # e.g. only healthy samples
+    if not unorganized_words:
+        return df.copy()
+
+    # Terms mapped in earlier runs and local matches are not asked again, only the rest goes to GPT
+    version = file_version(DISEASE_LIST_PATH, CANCER_LIST_PATH)
+    mapping, unresolved, hints = known_terms('Disease', version, unorganized_words, target_words, fuzzy_cutoff, store)
+
+    if unresolved:
+        # GPT
+        if engine is None:
+            engine = LLMEngine(api_key)
+
+        # Answers that leave out words of their chunk are asked again
+        def valid(chunk, answer):
+            chunk_mapping = parse_mapping(answer)
+            return all(word in chunk_mapping for word in chunk)
+
+        learned = {}
+        def write(chunk, answer):
+            chunk_mapping = parse_mapping(answer)
+            learned.update({word: str(chunk_mapping[word]) for word in chunk if word in chunk_mapping})
 
+        # Chunks of at most chunk_size words, asked in parallel
+        jobs = [(tuple(chunk), mapping_messages(chunk, target_words, hints)) for chunk in chunked(unresolved, chunk_size)]
+        engine.run(jobs, write, valid, JSON_OBJECT)
+        engine.report()
+
+        if store is not None:
+            store.update('Disease', version, learned, 'llm')
+        mapping.update(learned)
+
+    # Words that are still missing keep their original value
+    missing = [word for word in unorganized_words if word not in mapping]
+    if missing:
+        print(f"No mapping for {len(missing)} diseases, kept as they are: {missing}")
+
+    swapped_df = df.copy()
+    swapped_df['Disease'] = [mapping.get(x, x) if isinstance(x, str) else x for x in swapped_df['Disease']]
+    
+    return swapped_df
+
+
+def mapping_messages(unorganized_words, target_words, hints=None):
     # Intro
     prompt = "You are an expert biologist looking at some human diseases. "
     prompt += "Don't say anything else, just include the mapping results in your answer. "
@@ -82,73 +117,110 @@ def neaten_up(api_key, df):
 
     # Inputs
     prompt += "\n\n Here are the sets: "
-    prompt += f"\n\n[A]: {unorganized_words}"
+    prompt += f"\n\n[A]: {list(unorganized_words)}"
     prompt += f"\n\n[B]: {target_words}"
 
+    # Close spellings, which may still mean something else
+    chunk_hints = {word: hints[word] for word in unorganized_words if word in (hints or {})}
+    if chunk_hints:
+        prompt += "\n\n These words in B are spelled similarly to some words in A. They are only candidates, check that they mean the same (e.g. *Non-Small Cell Lung Cancer* is not *Small cell lung cancer*): "
+        prompt += f"\n\n[Candidates]: {chunk_hints}"
+
     # Formatting output
-    prompt += "\n\n You must include every words in set A in your answer. Answer in the following *exact* answer structure: \n\n word in A: word in B ..."
+    prompt += "\n\n You must include every words in set A in your answer. Respond with a JSON object only, mapping every word in A to a word in B: \n\n {\"word in A\": \"word in B\", ...}"
 
-    try:
-        response = client.chat.completions.create(
-            model=gpt_model,
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0,
-        )
-        answer = response.choices[0].message.content
-
-    except Exception as e:
-        print(f"Error processing {gsm_id}: {e}")
-        answer = "Error"
-
-    # Mapping
-    mapping = answer_to_dict(answer)
-    mapping[np.nan] = np.nan
-    swapped_df = df.copy()
-    swapped_df['Disease'] = [mapping[x] for x in swapped_df['Disease']]
-    
-    return swapped_df
+    return [{"role": "user", "content": prompt}]
 
 
-def split_cancer(swapped_df):
+def neaten_organs(df, fuzzy_cutoff=100, store=None):
+    # Organ term list
+    org = pd.read_csv(ORGAN_LIST_PATH)
+    organ_list = org['Organ'].tolist()
+
+    # Organs are already asked from the list, only stray spellings and overrides are mapped
+    organs = sorted(set(df[~df['Organ'].isna()]['Organ']))
+    mapping, _, _ = known_terms('Organ', file_version(ORGAN_LIST_PATH), organs, organ_list, fuzzy_cutoff, store)
+
+    df['Organ'] = [mapping.get(x, x) if isinstance(x, str) else x for x in df['Organ']]
+
+    return df
+
+
+def split_cancer(swapped_df, store=None):
     # Cancer_Type term list
-    can = pd.read_csv("/home/smcheong/SCraper/Cancer_list.csv")
+    can = pd.read_csv(CANCER_LIST_PATH)
     cancer_type_list = can['Cancer_type'].tolist()
 
     # Split Cancer Types from Disease
-    swapped_df['Cancer_Type'] = np.nan
+    swapped_df['Cancer_Type'] = pd.Series(np.nan, index=swapped_df.index, dtype=object)
     swapped_df.loc[swapped_df['Disease'].isin(cancer_type_list), 'Cancer_Type'] = swapped_df['Disease']
     swapped_df.loc[swapped_df['Disease'].isin(cancer_type_list), 'Disease'] = 'Cancer'
 
+    # Manual overrides of Cancer Types, e.g. to merge subtypes
+    if store is not None:
+        cancer_types = sorted(set(swapped_df[~swapped_df['Cancer_Type'].isna()]['Cancer_Type']))
+        mapping = store.lookup('Cancer', file_version(CANCER_LIST_PATH), cancer_types)
+        swapped_df['Cancer_Type'] = [mapping.get(x, x) for x in swapped_df['Cancer_Type']]
+
     neat_df = swapped_df.copy()
 
     return neat_df
 
 
+def tidy_up(neat_df):
+    # Tidy up healthy columns
+    neat_df.loc[~neat_df['Disease'].isna(), 'Healthy'] = np.nan
+    neat_df.loc[~neat_df['Cancer_Type'].isna(), 'Healthy'] = np.nan
+    return neat_df[OUTPUT_COLUMNS].copy()
+
+
+def add_neaten_arguments(parser):
+    # Options of the disease mapping, shared with pipeline.py
+    parser.add_argument('--chunk-size', type=int, default=200,
+                        help="Diseases per prompt for the ones that are not matched locally, 0 for a single prompt (default: 200)")
+    parser.add_argument('--fuzzy-cutoff', type=int, default=100,
+                        help="Fuzzy matching score (0-100) above which a disease is mapped without asking GPT, e.g. 95; "
+                             "by default (100) close spellings are only given to GPT as candidates")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Map the Disease and Organ columns to the terms in Disease_list.csv and Organ_list.csv.")
+    parser.add_argument('input_file')
+    parser.add_argument('output_file')
+    parser.add_argument('api_key')
+    add_neaten_arguments(parser)
+    add_vocab_arguments(parser)
+    add_llm_arguments(parser)
+
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
 
-    if len(sys.argv) != 4:
-        print("Usage: python neaten.py [input_file] [output_file] [API key]")
-        exit()
-    
-    input_filename = sys.argv[1]
-    output_filename = sys.argv[2]
-    api_key = sys.argv[3]
+    args = parse_args()
+
+    input_filename = args.input_file
+    output_filename = args.output_file
+    api_key = args.api_key
     
     # Read input and check format
     df = read_input(input_filename)
 
+    # Terms mapped in earlier runs, and manual overrides
+    store = vocab_from_args(args)
+
     # Run GPT
-    swapped_df = neaten_up(api_key, df)
+    swapped_df = neaten_up(api_key, df, engine_from_args(api_key, args), args.chunk_size, args.fuzzy_cutoff, store)
+    swapped_df = neaten_organs(swapped_df, args.fuzzy_cutoff, store)
 
     # Split Cancer
-    neat_df = split_cancer(swapped_df)
+    neat_df = split_cancer(swapped_df, store)
 
-    # Tidy up healthy columns
-    neat_df.loc[~neat_df['Disease'].isna(), 'Healthy'] = np.nan
-    neat_df.loc[~neat_df['Cancer_Type'].isna(), 'Healthy'] = np.nan
-    neat_df = neat_df[['Series', 'Sample Name', 'Organ', 'Healthy', 'Disease', 'Cancer_Type', 'Cancer_Tissue', 'Age', 'Sex']].copy()
+    if store is not None:
+        store.report()
+        store.close()
+
+    neat_df = tidy_up(neat_df)
 
     # Write final output
     neat_df.to_csv(output_filename, index=False)
@@ -0,0 +1,289 @@
+import os
+import glob
+import json
+import time
+import inspect
+import hashlib
+import argparse
+import functools
+
+import pandas as pd
+
+import get_methods
+import classify
+import annotate_primary
+import neaten
+from geo_cache import add_geo_arguments, geo_from_args
+from prompt_pack import add_pack_arguments
+from token_budget import add_budget_arguments, budget_from_args
+from llm_engine import GPT_MODEL, add_llm_arguments, engine_from_args
+from vocab_store import add_vocab_arguments, vocab_from_args
+from term_lists import DISEASE_LIST_PATH, CANCER_LIST_PATH, ORGAN_LIST_PATH, file_version
+
+
+DEFAULT_WORK_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'scrawler', 'pipeline')
+
+# Directory of the scripts, whose modules make up the code of a stage
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STAGES = ['sheet', 'methods', 'classify', 'annotate', 'neaten']
+
+
+def stage_key(name, config, input_keys):
+    # Hash of a stage's name, its config and the keys of the stages it reads
+    canonical = json.dumps({'stage': name, 'config': config, 'inputs': input_keys}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+def local_modules(module):
+    # Files of a module and of every module of this repository it imports, directly or through others
+    files = {}
+    stack = [module]
+    while stack:
+        current = stack.pop()
+        path = getattr(current, '__file__', None)
+        if current.__name__ in files or not path or os.path.dirname(os.path.abspath(path)) != REPO_DIR:
+            continue
+        files[current.__name__] = path
+
+        # Imported modules, and the modules of imported functions, classes and constants
+        for value in vars(current).values():
+            imported = value if inspect.ismodule(value) else inspect.getmodule(value)
+            if imported is not None:
+                stack.append(imported)
+
+    return sorted(files.values())
+
+
+def code_version(module):
+    # Hash of the code a stage runs, so a change to any module it uses invalidates its output
+    return file_version(*local_modules(module))
+
+
+class Pipeline:
+    # Stages run in one process in the order they were added, as
+    # func(work_path, *input DataFrames) -> DataFrame. Each output is saved in
+    # `work_dir` under the stage key, so a rerun loads the stages whose config and
+    # inputs did not change and only recomputes the rest. Saved outputs are only
+    # read when a stage that uses them has to run. work_path is a per-key file
+    # prefix for the stage's own files, e.g. the answers of an LLM stage so far.
+    # A saved output that complete(output) rejects, e.g. with failed lookups or
+    # Error answers, is computed again from the stage's own files on the next run.
+    # The stages after it are computed again too, or, with incomplete_skipped (the
+    # rejected rows are ones they leave out, like Error answers), continue from
+    # their own files.
+
+    def __init__(self, work_dir=DEFAULT_WORK_DIR, rerun=()):
+        os.makedirs(work_dir, exist_ok=True)
+        self.work_dir = work_dir
+        self.rerun = set(rerun)
+        self.stages = {}
+        self.keys = {}
+        self.outputs = {}
+
+        # Stats
+        self.timings = {}
+        self.cached = []
+
+    def add(self, name, func, inputs=(), config=None, complete=None, incomplete_skipped=False):
+        self.stages[name] = (func, list(inputs), config or {}, complete, incomplete_skipped)
+
+    def work_path(self, name):
+        return os.path.join(self.work_dir, f"{name}-{self.keys[name]}")
+
+    def output(self, name):
+        if name not in self.outputs:
+            self.outputs[name] = pd.read_pickle(f"{self.work_path(name)}.pkl")
+        return self.outputs[name]
+
+    def run(self, until=None):
+        # Runs the stages up to `until` (default: all) and returns the last output
+        computed = set()
+        resumed = set()
+        for name, (func, inputs, config, complete, incomplete_skipped) in self.stages.items():
+            self.keys[name] = stage_key(name, config, [self.keys[stage] for stage in inputs])
+            work_path = self.work_path(name)
+
+            # A stage is recomputed when asked to, or when one of its inputs was
+            forced = name in self.rerun or any(stage in computed for stage in inputs)
+            if forced:
+                for path in glob.glob(f"{glob.escape(work_path)}.*"):
+                    os.remove(path)
+
+            # An input that was only completed keeps the stage's own files, it continues from them
+            continued = any(stage in resumed for stage in inputs)
+            resume = not forced and os.path.exists(f"{work_path}.pkl") and (
+                continued or (complete is not None and not complete(self.output(name))))
+            if resume:
+                os.remove(f"{work_path}.pkl")
+                self.outputs.pop(name, None)
+
+            if not os.path.exists(f"{work_path}.pkl"):
+                print(f"\n[Pipeline] {'Completing' if resume else 'Running'} {name}\n")
+                start = time.perf_counter()
+                output = func(work_path, *[self.output(stage) for stage in inputs])
+                self.timings[name] = time.perf_counter() - start
+
+                # Write to a temporary name first so a killed run never leaves half a file
+                output.to_pickle(f"{work_path}.tmp")
+                os.replace(f"{work_path}.tmp", f"{work_path}.pkl")
+                self.outputs[name] = output
+                if resume and (continued or incomplete_skipped):
+                    resumed.add(name)
+                else:
+                    computed.add(name)
+            else:
+                self.cached.append(name)
+
+            if name == until:
+                break
+
+        return self.output(name)
+
+    def report(self):
+        print(f"\n[Pipeline] {len(self.cached)} stages from {self.work_dir}: {', '.join(self.cached) or '-'}")
+        for name, elapsed in self.timings.items():
+            print(f"[Pipeline] {name} computed in {elapsed:.1f}s")
+
+
+def read_sheet(work_path, input_file):
+    df, _ = get_methods.read_input(input_file)
+    return df
+
+
+def scrape_methods(work_path, sheet, args):
+    # Streaming PMID -> PMC -> Methods lookups of get_methods.py
+    fetcher, workers = get_methods.fetcher_from_args(args)
+    cache = get_methods.lookup_cache_from_args(args)
+    jats = get_methods.jats_from_args(args)
+    try:
+        df, incomplete = get_methods.stream_methods(sheet, fetcher, workers, cache, jats=jats)
+    finally:
+        fetcher.report()
+        if args.latency_log:
+            fetcher.write_latencies(args.latency_log)
+        fetcher.close()
+        if jats is not None:
+            jats.report()
+            jats.close()
+        if cache is not None:
+            cache.report()
+            cache.close()
+
+    print(f"\nMethods for {(df['Method'] != 'None').sum()} of {len(df)} samples scraped.\n")
+
+    # Series whose lookups failed, scraped again on the next run (see methods_complete)
+    df = df.sort_values(["Series", 'Sample Name'])
+    df.attrs['incomplete'] = sorted(incomplete)
+    return df
+
+
+def methods_complete(df):
+    return not df.attrs.get('incomplete')
+
+
+def classify_samples(work_path, methods_df, api_key, engine, pack, budget, geo):
+    # Answers go to [work_path].csv as they come, so an interrupted stage resumes from there
+    output_filename = f"{work_path}.csv"
+    classify.classify_category(api_key, methods_df[['Series', 'Sample Name', 'Method']], output_filename,
+                               engine=engine, pack=pack, budget=budget, geo=geo, resume=True)
+
+    classified = pd.read_csv(output_filename)
+    return pd.merge(methods_df, classified[['Sample Name', 'Category']], on='Sample Name')
+
+
+def annotate_samples(work_path, classified_df, api_key, engine, pack, budget, geo):
+    output_filename = f"{work_path}.csv"
+    primary_df = classified_df[classified_df['Category'] == 'Primary'].copy()
+    annotate_primary.annotate(api_key, primary_df, output_filename, engine=engine, pack=pack, budget=budget,
+                              geo=geo, resume=True)
+
+    return pd.read_csv(output_filename)
+
+
+def neaten_samples(work_path, annotated_df, api_key, engine, chunk_size, fuzzy_cutoff, store):
+    swapped_df = neaten.neaten_up(api_key, annotated_df, engine, chunk_size, fuzzy_cutoff, store)
+    swapped_df = neaten.neaten_organs(swapped_df, fuzzy_cutoff, store)
+    return neaten.tidy_up(neaten.split_cancer(swapped_df, store))
+
+
+def build_pipeline(args, engine, budget, geo, store):
+    pipeline = Pipeline(args.work_dir, filter(None, (args.rerun or '').split(',')))
+
+    # What changes the answers of an LLM stage
+    llm_config = {'model': GPT_MODEL, 'pack': args.pack, 'max_prompt_tokens': args.max_prompt_tokens,
+                  'geo_parser': args.geo_parser}
+
+    pipeline.add('sheet', functools.partial(read_sheet, input_file=args.input_file),
+                 config={'input': file_version(args.input_file)})
+    pipeline.add('methods', functools.partial(scrape_methods, args=args), ['sheet'],
+                 config={'mirror': args.mirror, 'jats': args.jats_source, 'code': code_version(get_methods)},
+                 complete=methods_complete)
+    pipeline.add('classify', functools.partial(classify_samples, api_key=args.api_key, engine=engine,
+                                               pack=args.pack, budget=budget, geo=geo), ['methods'],
+                 config={**llm_config, 'code': code_version(classify)},
+                 complete=lambda df: classify.classified(df).all(), incomplete_skipped=True)
+    pipeline.add('annotate', functools.partial(annotate_samples, api_key=args.api_key, engine=engine,
+                                               pack=args.pack, budget=budget, geo=geo), ['classify'],
+                 config={**llm_config, 'code': code_version(annotate_primary),
+                         'terms': file_version(ORGAN_LIST_PATH, DISEASE_LIST_PATH)},
+                 complete=lambda df: annotate_primary.annotated(df).all(), incomplete_skipped=True)
+    pipeline.add('neaten', functools.partial(neaten_samples, api_key=args.api_key, engine=engine,
+                                             chunk_size=args.chunk_size, fuzzy_cutoff=args.fuzzy_cutoff,
+                                             store=store), ['annotate'],
+                 config={'model': GPT_MODEL, 'chunk_size': args.chunk_size, 'fuzzy_cutoff': args.fuzzy_cutoff,
+                         'code': code_version(neaten),
+                         'terms': file_version(DISEASE_LIST_PATH, CANCER_LIST_PATH, ORGAN_LIST_PATH),
+                         'overrides': file_version(args.vocab_overrides) if args.vocab_overrides else None})
+
+    return pipeline
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run get_methods, classify, annotate_primary and neaten in one process, "
+                    "reusing the output of every stage whose inputs did not change.")
+    parser.add_argument('input_file')
+    parser.add_argument('output_file')
+    parser.add_argument('api_key')
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR,
+                        help=f"Directory of stage outputs (default: {DEFAULT_WORK_DIR})")
+    parser.add_argument('--rerun', default=None,
+                        help=f"Comma separated stages to compute again, with every stage after them: {','.join(STAGES)}")
+    parser.add_argument('--until', choices=STAGES, default=None,
+                        help="Stop after this stage and write its output instead")
+    add_pack_arguments(parser)
+    neaten.add_neaten_arguments(parser)
+    get_methods.add_fetch_arguments(parser)
+    add_budget_arguments(parser)
+    add_geo_arguments(parser)
+    add_vocab_arguments(parser)
+    add_llm_arguments(parser)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+
+    # Shared by every stage that needs them
+    engine = engine_from_args(args.api_key, args)
+    budget = budget_from_args(args)
+    geo = geo_from_args(args)
+    store = vocab_from_args(args)
+
+    pipeline = build_pipeline(args, engine, budget, geo, store)
+    try:
+        df = pipeline.run(args.until)
+    finally:
+        geo.close()
+        if store is not None:
+            store.report()
+            store.close()
+
+    pipeline.report()
+
+    df.to_csv(args.output_file, index=False)
+
+    print(f"\nYou can check your result in: {args.output_file}\n")
@@ -0,0 +1,65 @@
+from llm_answers import parse_json_object
+
+
+def chunked(items, size):
+    # Chunks of up to `size` items, or a single chunk if size is 0
+    if size <= 0:
+        if items:
+            yield items
+        return
+
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def add_pack_arguments(parser):
+    # --pack, shared by the per-sample LLM scripts and pipeline.py
+    parser.add_argument('--pack', type=int, default=1,
+                        help="Ask about up to this many samples of a Series in one prompt, 0 for the whole Series (default: 1)")
+
+
+def parse_packed_answer(answer, gsm_ids):
+    # {gsm_id: answer} from the JSON object in a packed answer. GSMs the model
+    # skipped are left out, and nothing is returned if there is no valid JSON.
+    answers = parse_json_object(answer) or {}
+    return {gsm_id: answers[gsm_id] for gsm_id in gsm_ids if gsm_id in answers}
+
+
+class PackedAnswers:
+    # {gsm_id: result} of the answer to a single or packed prompt, None for GSMs
+    # without a readable answer. parse_single(answer) reads the answer of a single
+    # prompt, parse_sample(value) the value of one GSM in a packed answer (None if
+    # the model skipped it). The last answer of each job is kept parsed between
+    # valid() and results(), so it is parsed once.
+
+    def __init__(self, packed, parse_single, parse_sample):
+        self.packed = packed
+        self.parse_single = parse_single
+        self.parse_sample = parse_sample
+        self.parsed = {}
+
+    def parse(self, key, answer):
+        _, gsm_ids = key
+        if not self.packed:
+            return {gsm_ids: self.parse_single(answer)}
+
+        answers = parse_packed_answer(answer, gsm_ids)
+        return {gsm_id: self.parse_sample(answers.get(gsm_id)) for gsm_id in gsm_ids}
+
+    def valid(self, key, answer):
+        # For LLMEngine.run: every GSM of the job has a result
+        return all(result is not None for result in self.lookup(key, answer).values())
+
+    def results(self, key, answer):
+        # Results of the final answer of a job
+        results = self.lookup(key, answer)
+        del self.parsed[key]
+        return results
+
+    def lookup(self, key, answer):
+        # The engine checks an answer more than once, and writes the last one it checked
+        last, results = self.parsed.get(key, (None, None))
+        if results is None or last != answer:
+            results = self.parse(key, answer)
+            self.parsed[key] = (answer, results)
+        return results
@@ -0,0 +1,132 @@
+from tqdm import tqdm
+
+from geo_cache import GEOCache
+from prompt_pack import chunked, add_pack_arguments
+from token_budget import TokenBudget, METHODS_PLACEHOLDER
+
+
+# Building blocks of the prompts of classify.py, annotate_primary.py and
+# classify_annotate.py. A prompt asks about one sample, or when packed about
+# every sample of a chunk of one Series; only the sample section and the answer
+# format differ between the two.
+
+def sample_text(gsm):
+    # GEO fields of a GSM as they are given to GPT
+    fields = ['characteristics_ch1', 'title', 'geo_accession', 'source_name_ch1', 'extract_protocol_ch1',
+              'characteristics_ch1']
+    return " \n ".join(gsm[field] for field in fields)
+
+
+def subject(packed):
+    return "each sample" if packed else "the particular sample"
+
+
+def introduction(packed, questions="a few questions"):
+    return ("You are an expert biologist. You are looking at some metadata provided by Gene Expression Omnibus and the method section of the original manuscript. "
+            f"Please use the given metadata of the overall experiment and the metadata of {subject(packed)} from that experiment to answer {questions} about {subject(packed)}. ")
+
+
+FOCUS = "Do not be confused by the experiment metadata if the experiment mentions multiple samples. Prioritize the description about the particular sample in the experiment when answering questions. "
+
+
+
+def questions_introduction(packed):
+    # Introduction of the prompts with several questions, which are listed right after it
+    prompt = introduction(packed) + "You can also use the given method section of the original manuscript. "
+    prompt += FOCUS + "Pay special notice to metadata related to the *particular sample* if the metadata of the experiment describes multiple types of samples. "
+    prompt += "Here are the questions: \n\n"
+
+    return prompt
+
+def classification(packed):
+    return (f"Based on its characteristics and method, classify {subject(packed)} with one of the following options - [Cultured, Fetal, Primary]. "
+            "If the sample is an in vitro sample, classify as Cultured. If the sample is from fetal tissue, classify as Fetal. If the sample is none of those, answer with Primary. "
+            "Isolation of a specific cell type from blood and direct sequencing is not treated as cultured. Do not classify samples derived from the mother as fetal. ")
+
+
+def annotation_questions(organ_list, disease_list, cancer_tissue_list):
+    # Main questions
+    prompt = f"\n [Organ] What organ is the sample from? Answer with one of the following options: \n {organ_list}"
+    prompt += "\n [Healthy] Is the sample from a healthy individual? Answer with *Yes* or *nan*. The cancer adjacent normal sample should be classified as *nan*. \n"
+    prompt += f"\n [Disease] What type of disease is the sample from? If the sample is from a healthy individual, please answer with nan. Answer with one of the following options: \n {disease_list}"
+    prompt += f"\n [Cancer_Tissue] If it is a cancer sample, which tissue the sample is from? The adjacent normal sample should not be classified as healthy but should be classified as *Adjacent_Normal*. If it is not a cancer sample, please answer with *nan*. Answer with one of the following options: \n {cancer_tissue_list}"
+
+    # Age, Sex
+    prompt += "\n [Age] If available, what is the age of the patient the sample is derived from? Answer in years or in days and weeks. Answer with *nan* if not available."
+    prompt += "\n [Sex] Is the sample derived from a male or female patient? Answer with letter *F* or M*. Answer with nan if not available."
+
+    # Tuning
+    prompt += "When a sample contains the word cortex, it may not necessarily be a brain sample. "
+    prompt += "Even if the exact matching term does not seem to be among the options provided, you *must* select the closest option from the provided list by using your medical knowledge. "
+    prompt += "If you are not sure, answer with 'Uncertain'. "
+
+    return prompt
+
+
+def metadata(experiment, chunk, packed):
+    # The experiment, the sample(s) and the place of the Methods
+    prompt = "\n [1] Here are the metadata associated: \n"
+    prompt += f"[1-1] Description about the experiment: \n {experiment}"
+    if packed:
+        for gsm_id, text in chunk:
+            prompt += f"\n [1-2] Description about sample {gsm_id}: \n {text}"
+    else:
+        prompt += f"\n [1-2] Description about the particular sample in the experiment: \n {chunk[0][1]}"
+    prompt += f"\n [2] Method of the original manuscript: {METHODS_PLACEHOLDER}"
+
+    return prompt
+
+
+def json_answer(fields, chunk, packed):
+    # A JSON object with `fields`, or one per GSM of the chunk. The single one
+    # follows the Methods directly, as in the original per-sample prompt.
+    example = ", ".join(f'"{field}": "[answer]"' for field in fields)
+    if packed:
+        return f"\n Answer the questions for every sample. Respond with a JSON object only, mapping the GSM ID of every sample to its answers, e.g. \n\n {{\"{chunk[0][0]}\": {{{example}}}}} \n\n"
+    return f"Respond with a JSON object only, with exactly these keys: \n\n {{{example}}} \n\n"
+
+
+def prompt_jobs(methods_df, gse_method_dict, build, pack=1, budget=None, geo=None):
+    # One prompt per GSM, as ((gse_id, gsm_id), messages), or with pack != 1 one
+    # prompt per chunk of up to `pack` GSMs (0: all) of a GSE, as ((gse_id, gsm_ids), messages).
+    # build(experiment, chunk, packed) gives the prompt for a chunk of (gsm_id, sample text).
+    if budget is None:
+        budget = TokenBudget()
+    own_geo = geo is None
+    if own_geo:
+        geo = GEOCache()
+
+    # Samples to ask about, as a set for the lookup of every GSM
+    sample_names = set(methods_df['Sample Name'])
+
+    packed = pack != 1
+
+    try:
+        for gse_id, method_text, series in tqdm(geo.iter_series(gse_method_dict), total=len(gse_method_dict)):
+
+            # Metadata from the GEO cache, downloaded ahead of time by the prefetcher
+            experiment = f"{series['summary']} \n {series['overall_design']}"
+
+            # We only want information of GSMs in our metadata
+            samples = [(gsm_id, sample_text(gsm)) for gsm_id, gsm in series['gsms'].items() if gsm_id in sample_names]
+
+            for chunk in chunked(samples, pack):
+                gsm_ids = tuple(gsm_id for gsm_id, _ in chunk)
+                key = (gse_id, gsm_ids) if packed else (gse_id, gsm_ids[0])
+
+                sample_texts = " \n ".join(text for _, text in chunk)
+                prompt = budget.fill(key, build(experiment, chunk, packed), method_text, experiment, sample_texts)
+                yield key, [{"role": "user", "content": prompt}]
+    finally:
+        # A GEO cache of our own is not used by anyone else
+        if own_geo:
+            geo.close()
+
+
+def add_sample_arguments(parser):
+    # Options shared by classify.py, annotate_primary.py and classify_annotate.py
+    parser.add_argument('--methods-store', default=None,
+                        help="Parquet store written by get_methods.py --methods-store (the input then has a PMC column instead of Method)")
+    add_pack_arguments(parser)
+    parser.add_argument('--resume', action='store_true',
+                        help="Keep the valid answers already in the output and only ask for the missing, Error or unparseable ones")
@@ -0,0 +1,32 @@
+import math
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+
+# How long to wait before sending a request again, shared by the page fetchers
+# of get_methods.py and the LLM engine
+
+
+def parse_retry_after(value):
+    # Seconds to wait from a Retry-After header, either "0.5" or an HTTP date, None if unreadable
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+        return max(seconds, 0.0) if math.isfinite(seconds) else None
+    except ValueError:
+        pass
+
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
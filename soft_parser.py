@@ -0,0 +1,88 @@
+import re
+import gzip
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+
+# The only metadata the prompts use
+GSE_FIELDS = ['summary', 'overall_design']
+GSM_FIELDS = ['characteristics_ch1', 'title', 'geo_accession', 'source_name_ch1', 'extract_protocol_ch1']
+
+# GEOparse strips every "!Word_" from metadata lines the same way
+ENTRY_PREFIX = re.compile(r"!\w*?_")
+
+ENTRY_LINE = re.compile(rb'^[!^][^\n]*', re.M)
+CHUNK_SIZE = 1 << 20
+
+
+def parse_entry(line):
+    # "!Sample_title = text" -> ("title", "text"), as GEOparse does
+    if line.startswith("!"):
+        line = ENTRY_PREFIX.sub("", line)
+    else:
+        line = line.strip()[1:]
+
+    entry_type, _, entry_name = line.partition("=")
+    return entry_type.strip(), entry_name.strip()
+
+
+def entry_lines(soft):
+    # Decoded lines of a binary SOFT file that start with ^ or !. Data table rows
+    # are skipped by the regex without ever becoming Python strings.
+    rest = b''
+    for block in iter(functools.partial(soft.read, CHUNK_SIZE), b''):
+        block = rest + block
+        cut = block.rfind(b'\n') + 1
+        for match in ENTRY_LINE.finditer(block, 0, cut):
+            yield match.group().decode('utf-8', 'ignore').rstrip()
+        rest = block[cut:]
+
+    for match in ENTRY_LINE.finditer(rest):
+        yield match.group().decode('utf-8', 'ignore').rstrip()
+
+
+def parse_soft(path, gse_fields=GSE_FIELDS, gsm_fields=GSM_FIELDS):
+    # Series and sample metadata of a (gzipped) family SOFT file, in the same
+    # shape as geo_cache.series_metadata. The file is streamed in blocks and only
+    # the metadata keys asked for are kept, data tables are never decoded.
+    gse_values = {field: [] for field in gse_fields}
+    gsms = {}
+
+    gse_keys = set(gse_fields)
+    gsm_keys = set(gsm_fields)
+
+    opener = gzip.open if path.endswith('.gz') else open
+    current = None
+    wanted = ()
+
+    with opener(path, 'rb') as soft:
+        for line in entry_lines(soft):
+            if line.startswith('^'):
+                entry_type, entry_name = parse_entry(line)
+                if entry_type == 'SERIES':
+                    current, wanted = gse_values, gse_keys
+                elif entry_type == 'SAMPLE':
+                    current = gsms[entry_name] = {field: [] for field in gsm_fields}
+                    wanted = gsm_keys
+                else:
+                    current, wanted = None, ()
+
+            elif current is not None:
+                if '_table_begin' in line or '_table_end' in line:
+                    continue
+                key, value = parse_entry(line)
+                if key in wanted:
+                    current[key].append(value)
+
+    metadata = {field: " ".join(values) for field, values in gse_values.items()}
+    metadata['gsms'] = {
+        gsm_id: {field: " ".join(values[field]) for field in gsm_fields}
+        for gsm_id, values in gsms.items()
+    }
+    return metadata
+
+
+def parse_soft_files(paths, processes=None):
+    # parse_soft for many files at once in a process pool, results in the order of paths
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(parse_soft, paths))
@@ -0,0 +1,20 @@
+import os
+import hashlib
+
+
+# Term lists next to the scripts. annotate_primary.py gives them to GPT as the
+# options, neaten.py maps the answers onto them, and the learned mappings in the
+# vocabulary store are versioned by them.
+TERM_LIST_DIR = os.path.dirname(os.path.abspath(__file__))
+DISEASE_LIST_PATH = os.path.join(TERM_LIST_DIR, "Disease_list.csv")
+CANCER_LIST_PATH = os.path.join(TERM_LIST_DIR, "Cancer_list.csv")
+ORGAN_LIST_PATH = os.path.join(TERM_LIST_DIR, "Organ_list.csv")
+
+
+def file_version(*paths):
+    # Hash of the term list files a mapping was made against
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
@@ -0,0 +1,172 @@
+import re
+import difflib
+
+import numpy as np
+
+try:
+    from rapidfuzz import fuzz, process
+except ImportError:
+    fuzz = process = None
+
+
+# "Amyotrophic lateral sclerosis (ALS)" -> name and abbreviation
+ABBREVIATION = re.compile(r"^(.*?)\s*\(([^()]+)\)\s*$")
+PUNCTUATION = re.compile(r"[^\w\s]")
+SEPARATORS = re.compile(r"[\s_\-/]+")
+
+# Words and prefixes that turn a term into its opposite: "Non-Small Cell Lung
+# Cancer" is not "Small cell lung cancer" however close the spelling is
+NEGATIONS = {'non', 'not', 'no', 'without'}
+NEGATING_PREFIXES = ('non', 'un')
+
+# A fuzzy match is only accepted this many points ahead of the next target
+FUZZY_MARGIN = 5
+
+# Targets scoring at least this are given to the LLM as candidates of a term
+HINT_CUTOFF = 70
+
+
+def normalize(term):
+    # Case, separators and punctuation do not count: "Lung_Cancer," == "lung cancer"
+    term = SEPARATORS.sub(" ", str(term).casefold())
+    return " ".join(PUNCTUATION.sub(" ", term).split())
+
+
+def negated_words(term, other):
+    # Words a normalized term negates: "non small cell" and "nonsmall cell" negate
+    # "small". "un" only counts before a word of the other term ("unaffected" vs "affected").
+    words = term.split()
+    negated = {word for negation, word in zip(words, words[1:]) if negation in NEGATIONS}
+    for word in words:
+        for prefix in NEGATING_PREFIXES:
+            stem = word[len(prefix):]
+            if word.startswith(prefix) and len(stem) > 2 and (prefix != 'un' or stem in other.split()):
+                negated.add(stem)
+    return negated
+
+
+def contradicts(query, key):
+    # True if one of two normalized terms negates what the other one says
+    return negated_words(query, key) != negated_words(key, query)
+
+
+def vocabulary_keys(targets):
+    # {normalized key: target} with every target under its full name, its name
+    # without the abbreviation, and the abbreviation itself. Keys that would
+    # point at different targets are left out.
+    keys = {}
+    ambiguous = set()
+
+    for target in targets:
+        names = [target]
+        match = ABBREVIATION.match(target)
+        if match:
+            names += [match.group(1), match.group(2)]
+
+        for name in names:
+            key = normalize(name)
+            if not key:
+                continue
+            if keys.get(key, target) != target:
+                ambiguous.add(key)
+            keys[key] = target
+
+    return {key: target for key, target in keys.items() if key not in ambiguous}
+
+
+class TermMatcher:
+    # Maps free-text terms onto a target vocabulary without the LLM where it is
+    # safe: exact matches, then matches after normalize() (which also catches
+    # abbreviations). Fuzzy matches are only accepted with fuzzy_cutoff < 100 (off
+    # by default), and then only if they score at least `fuzzy_cutoff` (0-100),
+    # FUZZY_MARGIN points more than any other target, and do not negate the term.
+    # hints() gives the closest targets of the terms left for the LLM instead.
+    # Fuzzy scores of all terms against all keys are computed in one rapidfuzz
+    # cdist call, or with difflib if rapidfuzz is missing.
+
+    def __init__(self, targets, fuzzy_cutoff=100, name='Terms'):
+        self.name = name
+        self.targets = list(targets)
+        self.exact = set(self.targets)
+        self.keys = vocabulary_keys(self.targets)
+        self.fuzzy_cutoff = fuzzy_cutoff
+
+        # Stats
+        self.exact_matches = 0
+        self.normalized_matches = 0
+        self.fuzzy_matches = 0
+        self.unresolved = 0
+
+    def match(self, terms):
+        # ({term: target} of exact and normalized matches, {term: target} of
+        # fuzzy matches, [terms that are left for the LLM]) in the order of terms
+        mapping = {}
+        fuzzy = {}
+        fuzzy_terms = []
+
+        for term in terms:
+            if term in self.exact:
+                mapping[term] = term
+                self.exact_matches += 1
+            elif normalize(term) in self.keys:
+                mapping[term] = self.keys[normalize(term)]
+                self.normalized_matches += 1
+            else:
+                fuzzy_terms.append(term)
+
+        if fuzzy_terms and self.fuzzy_cutoff < 100:
+            fuzzy = self.fuzzy_match(fuzzy_terms)
+            self.fuzzy_matches += len(fuzzy)
+
+        unresolved = [term for term in terms if term not in mapping and term not in fuzzy]
+        self.unresolved += len(unresolved)
+        return mapping, fuzzy, unresolved
+
+    def fuzzy_match(self, terms):
+        matched = {}
+        for term, ranking in self.rank(terms, 2).items():
+            if not ranking:
+                continue
+            key, target, score = ranking[0]
+            runner_up = ranking[1][2] if len(ranking) > 1 else 0
+            if score >= self.fuzzy_cutoff and score - runner_up >= FUZZY_MARGIN and not contradicts(normalize(term), key):
+                matched[term] = target
+        return matched
+
+    def hints(self, terms, limit=3):
+        # {term: [up to `limit` closest targets]} for the terms with targets scoring at least HINT_CUTOFF
+        hints = {}
+        for term, ranking in self.rank(terms, limit).items():
+            targets = [target for _, target, score in ranking if score >= HINT_CUTOFF]
+            if targets:
+                hints[term] = targets
+        return hints
+
+    def rank(self, terms, depth):
+        # {term: [(key, target, score)]}, the best scoring key of up to `depth` targets, best first
+        keys = list(self.keys)
+        if not keys or not terms:
+            return {term: [] for term in terms}
+
+        queries = [normalize(term) for term in terms]
+        if process is None:
+            scores = np.array([[round(100 * difflib.SequenceMatcher(None, query, key).ratio()) for key in keys]
+                               for query in queries], dtype=np.uint8)
+        else:
+            scores = process.cdist(queries, keys, scorer=fuzz.token_sort_ratio, dtype=np.uint8, workers=-1)
+
+        ranks = {}
+        for term, row in zip(terms, scores):
+            ranking = []
+            for index in np.argsort(-row.astype(int), kind='stable'):
+                target = self.keys[keys[index]]
+                if all(target != ranked for _, ranked, _ in ranking):
+                    ranking.append((keys[index], target, int(row[index])))
+                    if len(ranking) == depth:
+                        break
+            ranks[term] = ranking
+        return ranks
+
+    def report(self):
+        print(f"[{self.name}] {self.exact_matches} exact, {self.normalized_matches} normalized, "
+              f"{self.fuzzy_matches} fuzzy matches, {self.unresolved} unresolved")
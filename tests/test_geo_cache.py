@@ -0,0 +1,19 @@
+import json
+
+from geo_cache import GEOCache
+
+
+def test_close_stops_prefetch_and_parse_pools(tmp_path):
+    for gse_id in ['GSE1', 'GSE2', 'GSE3']:
+        (tmp_path / f"{gse_id}.json").write_text(json.dumps({'summary': gse_id, 'overall_design': '', 'gsms': {}}))
+
+    with GEOCache(str(tmp_path), workers=1, processes=1) as geo:
+        series = geo.iter_series({'GSE1': 1, 'GSE2': 2, 'GSE3': 3})
+        assert next(series)[0] == 'GSE1'
+        assert len(geo.prefetch_pools) == 1
+        pool = next(iter(geo.prefetch_pools))
+
+    # The generator was left unfinished
+    assert pool._shutdown
+    assert not geo.prefetch_pools
+    assert geo.parse_pool is None
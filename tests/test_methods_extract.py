@@ -0,0 +1,26 @@
+import pytest
+
+from methods_extract import extract_methods_bs4, extract_methods_lxml
+
+
+# The lxml extractor has to give exactly the text of the reference bs4 one
+PAGES = [
+    '<div id="m"><h2>Methods</h2><p>foo<script>x</script>bar</p></div>',
+    '<div id="m"><h2>Methods</h2><p>foo<style>p {}</style>bar</p></div>',
+    '<div id="m"><h2>Methods</h2><p>foo<template><b>x</b></template>bar</p></div>',
+    '<div id="m"><h2>Methods</h2><p>foo<!-- note -->bar</p></div>',
+    '<div id="m"><h2>Methods</h2><p>Cells were <i>sorted</i>and<b>counted</b>.</p></div>',
+    '<div id="m"><h2>Materials and <i>Methods</i></h2><p>text</p></div>',
+    '<div><h2>Methods</h2><p>no id</p></div>',
+    '<div id="a"><h2>Results</h2><p>none</p></div>',
+]
+
+
+@pytest.mark.parametrize('page_html', PAGES)
+def test_lxml_matches_bs4(page_html):
+    assert extract_methods_lxml(page_html) == extract_methods_bs4(page_html)
+
+
+def test_skipped_elements_keep_separator():
+    page_html = '<div id="m"><h2>Methods</h2><p>foo<script>x</script>bar</p></div>'
+    assert extract_methods_lxml(page_html) == "Methods foo bar"
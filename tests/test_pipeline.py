@@ -0,0 +1,61 @@
+import os
+
+import pandas as pd
+
+import pipeline
+from pipeline import Pipeline, local_modules
+
+
+def test_code_version_covers_imported_modules():
+    files = {os.path.basename(path) for path in local_modules(pipeline.classify)}
+    assert {'classify.py', 'prompts.py', 'token_budget.py', 'llm_engine.py', 'geo_cache.py'} <= files
+
+
+def build(work_dir, answers, calls, incomplete_skipped=True):
+    def answer(work_path, *inputs):
+        # Keeps its answers in work_path.csv like the LLM stages, asks again only for Error ones
+        calls.append('answer')
+        path = f"{work_path}.csv"
+        done = pd.read_csv(path) if os.path.exists(path) else pd.DataFrame({'Sample': ['a', 'b'], 'Answer': 'Error'})
+        done.loc[done['Answer'] == 'Error', 'Answer'] = answers.pop(0)
+        done.to_csv(path, index=False)
+        return done
+
+    def count(work_path, answered):
+        calls.append('count')
+        with open(f"{work_path}.log", 'a') as file:
+            file.write("run\n")
+        return pd.DataFrame({'Answers': [(answered['Answer'] != 'Error').sum()]})
+
+    stages = Pipeline(str(work_dir))
+    stages.add('answer', answer, complete=lambda df: (df['Answer'] != 'Error').all(), incomplete_skipped=incomplete_skipped)
+    stages.add('count', count, ['answer'])
+    return stages
+
+
+def test_incomplete_output_is_completed_on_the_next_run(tmp_path):
+    calls = []
+    assert build(tmp_path, ['Error'], calls).run()['Answers'][0] == 0
+    assert build(tmp_path, ['Yes'], calls).run()['Answers'][0] == 2
+
+    # Complete outputs are loaded, and the next stage kept its own files when it was completed
+    assert build(tmp_path, [], calls).run()['Answers'][0] == 2
+    assert calls == ['answer', 'count', 'answer', 'count']
+    [log] = [name for name in os.listdir(tmp_path) if name.endswith('.log')]
+    assert open(tmp_path / log).read() == "run\nrun\n"
+
+
+def test_later_stages_start_over_after_an_input_they_used_is_completed(tmp_path):
+    calls = []
+    build(tmp_path, ['Error'], calls, incomplete_skipped=False).run()
+    assert build(tmp_path, ['Yes'], calls, incomplete_skipped=False).run()['Answers'][0] == 2
+
+    [log] = [name for name in os.listdir(tmp_path) if name.endswith('.log')]
+    assert open(tmp_path / log).read() == "run\n"
+
+
+def test_failed_lookups_make_the_methods_stage_incomplete():
+    df = pd.DataFrame({'Series': ['GSE1']})
+    df.attrs['incomplete'] = ['GSE1']
+    assert not pipeline.methods_complete(df)
+    assert pipeline.methods_complete(pd.DataFrame({'Series': ['GSE1']}))
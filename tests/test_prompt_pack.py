@@ -0,0 +1,32 @@
+from classify import parse_category
+from prompt_pack import PackedAnswers
+
+
+def test_packed_answers_per_gsm():
+    answers = PackedAnswers(True, parse_category, parse_category)
+    key = ('GSE1', ('GSM1', 'GSM2', 'GSM3'))
+    answer = '```json\n{"GSM1": "primary", "GSM2": "Cultured."}\n```'
+
+    # GSM3 was skipped by the model
+    assert not answers.valid(key, answer)
+    assert answers.results(key, answer) == {'GSM1': 'Primary', 'GSM2': 'Cultured', 'GSM3': None}
+
+
+def test_answers_parsed_once():
+    calls = []
+
+    def parse(answer):
+        calls.append(answer)
+        return parse_category(answer)
+
+    answers = PackedAnswers(False, parse, parse)
+    key = ('GSE1', 'GSM1')
+
+    assert not answers.valid(key, "Maybe")
+    assert answers.valid(key, "Fetal")
+    assert answers.valid(key, "Fetal")
+    assert answers.results(key, "Fetal") == {'GSM1': 'Fetal'}
+    assert calls == ["Maybe", "Fetal"]
+
+    # Failed requests are written without being checked
+    assert answers.results(key, "Error") == {'GSM1': None}
@@ -0,0 +1,63 @@
+import pandas as pd
+
+from classify import classify_jobs
+from annotate_primary import annotate_jobs
+
+
+# The --pack 1 prompts are the original per-sample ones, byte for byte
+GSM = {'characteristics_ch1': 'tissue: lung', 'title': 'Lung 1', 'geo_accession': 'GSM1',
+       'source_name_ch1': 'lung biopsy', 'extract_protocol_ch1': 'TRIzol'}
+SAMPLE = "tissue: lung \n Lung 1 \n GSM1 \n lung biopsy \n TRIzol \n tissue: lung"
+
+CLASSIFY_PROMPT = (
+    "You are an expert biologist. You are looking at some metadata provided by Gene Expression Omnibus and the method section of the original manuscript. Please use the given metadata of the overall experiment and the metadata of the particular sample from that experiment to answer a few questions about the particular sample. "
+    "Based on its characteristics and method, classify the sample with one of the following options - [Cultured, Fetal, Primary]. If the sample is an in vitro sample, classify as Cultured. If the sample is from fetal tissue, classify as Fetal. If the sample is none of those, answer with Primary. Isolation of a specific cell type from blood and direct sequencing is not treated as cultured. Do not classify samples derived from the mother as fetal. Please use the given metadata of the overall experiment and the metadata of the particular sample from that experiment to answer a few questions about the particular sample. Do not be confused by the experiment metadata if the experiment mentions multiple samples. Prioritize the description about the particular sample in the experiment when answering questions."
+    "Please respond with one word only. "
+    "\n Here are the metadata associated: \n\n Description about the experiment: \n Summary \n Design"
+    f"\n Description about the particular sample in the experiment: \n {SAMPLE}"
+    "\n Method of the original manuscript: Methods text."
+)
+
+ANNOTATE_PROMPT = (
+    "You are an expert biologist. You are looking at some metadata provided by Gene Expression Omnibus and the method section of the original manuscript. Please use the given metadata of the overall experiment and the metadata of the particular sample from that experiment to answer a few questions about the particular sample. You can also use the given method section of the original manuscript. "
+    "Do not be confused by the experiment metadata if the experiment mentions multiple samples. Prioritize the description about the particular sample in the experiment when answering questions. Pay special notice to metadata related to the *particular sample* if the metadata of the experiment describes multiple types of samples. "
+    "Here are the questions: \n\n"
+    "\n [Organ] What organ is the sample from? Answer with one of the following options: \n ['Lung']"
+    "\n [Healthy] Is the sample from a healthy individual? Answer with *Yes* or *nan*. The cancer adjacent normal sample should be classified as *nan*. \n"
+    "\n [Disease] What type of disease is the sample from? If the sample is from a healthy individual, please answer with nan. Answer with one of the following options: \n ['Asthma']"
+    "\n [Cancer_Tissue] If it is a cancer sample, which tissue the sample is from? The adjacent normal sample should not be classified as healthy but should be classified as *Adjacent_Normal*. If it is not a cancer sample, please answer with *nan*. Answer with one of the following options: \n ['Tumor']"
+    "\n [Age] If available, what is the age of the patient the sample is derived from? Answer in years or in days and weeks. Answer with *nan* if not available."
+    "\n [Sex] Is the sample derived from a male or female patient? Answer with letter *F* or M*. Answer with nan if not available."
+    "When a sample contains the word cortex, it may not necessarily be a brain sample. "
+    "Even if the exact matching term does not seem to be among the options provided, you *must* select the closest option from the provided list by using your medical knowledge. "
+    "If you are not sure, answer with 'Uncertain'. "
+    "\n [1] Here are the metadata associated: \n"
+    "[1-1] Description about the experiment: \n Summary \n Design"
+    f"\n [1-2] Description about the particular sample in the experiment: \n {SAMPLE}"
+    "\n [2] Method of the original manuscript: Methods text."
+    'Respond with a JSON object only, with exactly these keys: \n\n {"Organ": "[answer]", "Healthy": "[answer]", "Disease": "[answer]", "Cancer_Tissue": "[answer]", "Age": "[answer]", "Sex": "[answer]"} \n\n'
+)
+
+
+class FakeGEO:
+    def iter_series(self, series_values):
+        for gse_id, value in series_values.items():
+            yield gse_id, value, {'summary': 'Summary', 'overall_design': 'Design', 'gsms': {'GSM1': GSM}}
+
+
+def only_prompt(jobs):
+    [(key, messages)] = list(jobs)
+    assert key == ('GSE1', 'GSM1')
+    return messages[0]['content']
+
+
+def test_single_classify_prompt():
+    methods_df = pd.DataFrame({'Series': ['GSE1'], 'Sample Name': ['GSM1']})
+    jobs = classify_jobs(methods_df, {'GSE1': 'Methods text.'}, pack=1, geo=FakeGEO())
+    assert only_prompt(jobs) == CLASSIFY_PROMPT
+
+
+def test_single_annotate_prompt():
+    methods_df = pd.DataFrame({'Series': ['GSE1'], 'Sample Name': ['GSM1']})
+    jobs = annotate_jobs(methods_df, {'GSE1': 'Methods text.'}, ['Lung'], ['Asthma'], ['Tumor'], pack=1, geo=FakeGEO())
+    assert only_prompt(jobs) == ANNOTATE_PROMPT
@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from retries import parse_retry_after
+from llm_engine import retry_delay
+
+
+@pytest.mark.parametrize('value, expected', [('0.5', 0.5), ('3', 3.0), ('-1', 0.0), ('nan', None), ('soon', None), ('', None)])
+def test_parse_retry_after_seconds(value, expected):
+    assert parse_retry_after(value) == expected
+
+
+def test_parse_retry_after_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after(format_datetime(when, usegmt=True)) <= 30
+
+
+def rate_limit_error(headers):
+    # Only the response headers of an OpenAI error are read
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+
+def test_llm_retry_delay_reads_http_dates():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < retry_delay(rate_limit_error({'retry-after': format_datetime(when, usegmt=True)}), 0) <= 30
+
+
+def test_llm_retry_delay_falls_back_to_backoff():
+    assert 0 <= retry_delay(rate_limit_error({'retry-after': 'soon'}), 2) <= 4
+    assert 0 <= retry_delay(SimpleNamespace(), 2) <= 4
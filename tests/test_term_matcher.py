@@ -0,0 +1,66 @@
+import pytest
+
+import term_matcher
+from term_matcher import TermMatcher, contradicts, normalize
+
+
+TARGETS = ['Non-Small Cell Lung Cancer (NSCLC)', 'Amyotrophic lateral sclerosis (ALS)', 'Type 2 Diabetes',
+           'Hodgkin Lymphoma', 'Lung Adenocarcinoma', 'Lung Squamous Cell Carcinoma']
+
+
+@pytest.fixture(params=['rapidfuzz', 'difflib'])
+def scorer(request, monkeypatch):
+    if request.param == 'difflib':
+        monkeypatch.setattr(term_matcher, 'process', None)
+    elif term_matcher.process is None:
+        pytest.skip("rapidfuzz is not installed")
+
+
+def test_exact_and_normalized_matches(scorer):
+    mapping, fuzzy, unresolved = TermMatcher(TARGETS).match(['Type 2 Diabetes', 'type-2 diabetes', 'ALS', 'nsclc'])
+    assert mapping == {'Type 2 Diabetes': 'Type 2 Diabetes', 'type-2 diabetes': 'Type 2 Diabetes',
+                       'ALS': 'Amyotrophic lateral sclerosis (ALS)', 'nsclc': 'Non-Small Cell Lung Cancer (NSCLC)'}
+    assert fuzzy == {} and unresolved == []
+
+
+def test_fuzzy_matches_are_off_by_default(scorer):
+    mapping, fuzzy, unresolved = TermMatcher(TARGETS).match(['Type 2 Diabetis'])
+    assert mapping == {} and fuzzy == {}
+    assert unresolved == ['Type 2 Diabetis']
+
+
+@pytest.mark.parametrize('term', ['Small cell lung cancer', 'small-cell lung cancer', 'non-Hodgkin lymphoma'])
+def test_negated_terms_are_not_fuzzy_matched(scorer, term):
+    _, fuzzy, unresolved = TermMatcher(TARGETS, fuzzy_cutoff=80).match([term])
+    assert fuzzy == {}
+    assert unresolved == [term]
+
+
+def test_negated_terms_are_only_hints(scorer):
+    matcher = TermMatcher(TARGETS)
+    _, _, unresolved = matcher.match(['Small cell lung cancer'])
+    assert 'Non-Small Cell Lung Cancer (NSCLC)' in matcher.hints(unresolved)['Small cell lung cancer']
+
+
+def test_fuzzy_match_needs_a_margin_over_the_runner_up(scorer):
+    targets = ['Lung Cancer Type A', 'Lung Cancer Type B']
+    _, fuzzy, _ = TermMatcher(targets, fuzzy_cutoff=80).match(['Lung Cancer Type C'])
+    assert fuzzy == {}
+
+
+def test_strict_fuzzy_match(scorer):
+    mapping, fuzzy, unresolved = TermMatcher(TARGETS, fuzzy_cutoff=90).match(['Type 2 Diabetis'])
+    assert fuzzy == {'Type 2 Diabetis': 'Type 2 Diabetes'}
+    assert mapping == {} and unresolved == []
+
+
+@pytest.mark.parametrize('query, key, expected', [
+    ('small cell lung cancer', 'non small cell lung cancer', True),
+    ('nonsmall cell lung cancer', 'non small cell lung cancer', False),
+    ('nonsmall cell lung cancer', 'small cell lung cancer', True),
+    ('affected', 'unaffected', True),
+    ('unspecified lung cancer', 'lung cancer', False),
+    ('not infected', 'infected', True),
+])
+def test_contradicts(query, key, expected):
+    assert contradicts(normalize(query), normalize(key)) == expected
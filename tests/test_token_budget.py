@@ -0,0 +1,22 @@
+import pytest
+
+from token_budget import RELEVANT_PATTERN, select_passages
+
+
+# Terms are whole words, not substrings of longer ones
+@pytest.mark.parametrize('text', ['at this stage', 'cells were passaged', 'female mice', 'normalized counts'])
+def test_no_substring_matches(text):
+    assert not ({'age', 'male', 'normal'} & set(RELEVANT_PATTERN.findall(text)))
+
+
+@pytest.mark.parametrize('text, term', [
+    ('age of the donor', 'age'), ('male patients', 'male'), ('cells were cultured', 'cultured'),
+    ('surgical resection', 'surgical'), ('two tumors', 'tumors'),
+])
+def test_term_matches(text, term):
+    assert term in RELEVANT_PATTERN.findall(text)
+
+
+def test_select_passages_prefers_relevant_sentences():
+    method_text = "Females normalized at stage. Tissue came from a donor."
+    assert select_passages(method_text, "", 8) == "Tissue came from a donor."
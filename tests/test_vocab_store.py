@@ -0,0 +1,14 @@
+from neaten import known_terms
+from vocab_store import VocabStore
+
+
+TARGETS = ['Non-Small Cell Lung Cancer (NSCLC)', 'Type 2 Diabetes']
+
+
+def test_local_matches_are_not_stored(tmp_path):
+    store = VocabStore(str(tmp_path / 'vocab.sqlite'))
+    mapping, unresolved, _ = known_terms('Disease', 'v1', ['type 2 diabetes', 'Type 2 Diabetis'], TARGETS, 90, store)
+    assert mapping == {'type 2 diabetes': 'Type 2 Diabetes', 'Type 2 Diabetis': 'Type 2 Diabetes'}
+    assert unresolved == []
+    assert store.lookup('Disease', 'v1', ['type 2 diabetes', 'Type 2 Diabetis']) == {}
+
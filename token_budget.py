@@ -0,0 +1,158 @@
+import re
+import csv
+import functools
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from llm_engine import GPT_MODEL
+
+
+# Stands in for the Methods text while the rest of a prompt is measured
+METHODS_PLACEHOLDER = "\x00METHODS\x00"
+
+# Words that tell Cultured / Fetal / Primary and organ or donor apart, matched as
+# whole words (or their plural); a trailing * also matches any ending of a stem
+RELEVANT_TERMS = [
+    'tissue', 'cultur*', 'in vitro', 'cell line', 'passage', 'organoid', 'ipsc', 'stem cell', 'differentiat*',
+    'donor', 'patient', 'biopsy', 'biopsies', 'resect*', 'surg*', 'autops*', 'fetal', 'fetus', 'embryo*',
+    'gestation*', 'isolat*', 'dissociat*', 'digest*', 'sorted', 'facs', 'blood', 'pbmc', 'tumor', 'tumour',
+    'adjacent', 'normal', 'healthy', 'age', 'male', 'female', 'mouse', 'human',
+]
+RELEVANT_PATTERN = re.compile(r'\b(?:' + '|'.join(
+    re.escape(term[:-1]) + r'\w*' if term.endswith('*') else re.escape(term) + 's?' for term in RELEVANT_TERMS) + r')\b')
+
+LOG_COLUMNS = ['Series', 'Sample Name', 'Prompt', 'Instructions', 'Experiment', 'Sample', 'Methods', 'Methods_Full']
+
+
+@functools.lru_cache(maxsize=None)
+def encoding(model):
+    # None without tiktoken, or if its encoding files cannot be downloaded
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        print(f"Could not load the tiktoken encoding, estimating tokens instead: {e}")
+        return None
+
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text, model=GPT_MODEL):
+    # Exact with tiktoken, otherwise about four characters per token
+    if encoding(model) is None:
+        return (len(text) + 3) // 4
+    return len(encoding(model).encode(text, disallowed_special=()))
+
+
+@functools.lru_cache(maxsize=16)
+def passages(method_text, model=GPT_MODEL):
+    # Sentences of the Methods text with their token counts and lowercase text
+    sentences = re.split(r'(?<=[.!?])\s+(?=[A-Z0-9])', method_text)
+    return tuple((sentence, count_tokens(sentence, model) + 1, sentence.lower()) for sentence in sentences if sentence)
+
+
+def select_passages(method_text, query, max_tokens, model=GPT_MODEL):
+    # The sentences most relevant to the sample that fit in max_tokens, in their original order
+    query_words = {word for word in re.findall(r'[a-z][a-z0-9-]{3,}', query.lower())}
+
+    scores = []
+    for index, (sentence, tokens, lower) in enumerate(passages(method_text, model)):
+        score = 2 * len(set(RELEVANT_PATTERN.findall(lower)))
+        score += len(query_words.intersection(re.findall(r'[a-z][a-z0-9-]{3,}', lower)))
+        scores.append((-score, index, tokens))
+
+    chosen = []
+    used = 0
+    for _, index, tokens in sorted(scores):
+        if used + tokens <= max_tokens:
+            chosen.append(index)
+            used += tokens
+
+    sentences = passages(method_text, model)
+    return " ".join(sentences[index][0] for index in sorted(chosen))
+
+
+class TokenBudget:
+    # Counts the tokens of each part of a prompt and, when the prompt is over
+    # `max_tokens`, only keeps the Methods sentences most relevant to the sample.
+    # Every prompt is logged to `log_path` (CSV) if given.
+
+    def __init__(self, max_tokens=None, log_path=None, model=GPT_MODEL):
+        self.max_tokens = max_tokens
+        self.model = model
+        self.log_path = log_path
+
+        if log_path:
+            with open(log_path, 'w', newline='') as file:
+                csv.writer(file).writerow(LOG_COLUMNS)
+
+        # Stats
+        self.prompts = 0
+        self.trimmed = 0
+        self.totals = dict.fromkeys(LOG_COLUMNS[2:], 0)
+
+    def fill(self, key, prompt, method_text, experiment, sample):
+        # prompt has METHODS_PLACEHOLDER where the Methods go, key is (gse_id, gsm_id or gsm_ids)
+        method_text = str(method_text)
+        if not (self.max_tokens or self.log_path):
+            return prompt.replace(METHODS_PLACEHOLDER, method_text)
+
+        rest = count_tokens(prompt.replace(METHODS_PLACEHOLDER, ""), self.model)
+        counts = {
+            'Experiment': count_tokens(experiment, self.model),
+            'Sample': count_tokens(sample, self.model),
+            'Methods_Full': count_tokens(method_text, self.model),
+        }
+        counts['Instructions'] = max(0, rest - counts['Experiment'] - counts['Sample'])
+
+        if self.max_tokens and rest + counts['Methods_Full'] > self.max_tokens:
+            method_text = select_passages(method_text, sample, max(0, self.max_tokens - rest), self.model)
+            counts['Methods'] = count_tokens(method_text, self.model)
+            self.trimmed += 1
+        else:
+            counts['Methods'] = counts['Methods_Full']
+        counts['Prompt'] = rest + counts['Methods']
+
+        self.log(key, counts)
+        return prompt.replace(METHODS_PLACEHOLDER, method_text)
+
+    def log(self, key, counts):
+        self.prompts += 1
+        for column in self.totals:
+            self.totals[column] += counts[column]
+
+        if self.log_path:
+            gse_id, gsm_ids = key
+            if not isinstance(gsm_ids, str):
+                gsm_ids = ";".join(gsm_ids)
+            with open(self.log_path, 'a', newline='') as file:
+                csv.writer(file).writerow([gse_id, gsm_ids] + [counts[column] for column in LOG_COLUMNS[2:]])
+
+    def report(self):
+        if not self.prompts:
+            return
+
+        average = {column: total / self.prompts for column, total in self.totals.items()}
+        counter = "tiktoken" if encoding(self.model) is not None else "estimated"
+        print(f"[Tokens] {self.prompts} prompts, {self.totals['Prompt']} tokens ({counter}), "
+              f"{self.trimmed} with Methods trimmed to fit {self.max_tokens}")
+        print(f"  average per prompt: instructions {average['Instructions']:.0f}, experiment {average['Experiment']:.0f}, "
+              f"sample {average['Sample']:.0f}, methods {average['Methods']:.0f} (of {average['Methods_Full']:.0f})")
+
+
+def add_budget_arguments(parser):
+    # Options shared by the scripts that put Methods text into prompts
+    parser.add_argument('--max-prompt-tokens', type=int, default=None,
+                        help="Trim the Methods text to the sentences most relevant to the sample so prompts fit this many tokens")
+    parser.add_argument('--token-log', default=None,
+                        help="CSV with the tokens of every prompt, split into instructions, experiment, sample and Methods")
+
+
+def budget_from_args(args):
+    return TokenBudget(args.max_prompt_tokens, args.token_log)
@@ -0,0 +1,103 @@
+import os
+import csv
+import time
+import sqlite3
+
+
+DEFAULT_VOCAB_STORE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'scrawler', 'vocab.sqlite')
+
+OVERRIDE_COLUMNS = ['Vocabulary', 'Term', 'Target']
+
+
+class VocabStore:
+    # Persistent term -> canonical term mappings of neaten.py, per vocabulary
+    # ('Disease', 'Organ', 'Cancer'). Learned mappings are kept with the version
+    # of the term lists they were made against and are not used once the lists
+    # change. Manual overrides apply to every version and win over learned ones.
+    # Local (exact, normalized or fuzzy) matches of neaten.py are not stored,
+    # they are made again on every run.
+
+    def __init__(self, path=DEFAULT_VOCAB_STORE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS mappings (
+                vocabulary TEXT NOT NULL,
+                term TEXT NOT NULL,
+                version TEXT NOT NULL,
+                target TEXT NOT NULL,
+                source TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (vocabulary, term, version)
+            )
+        """)
+        self.conn.commit()
+
+        # Stats
+        self.hits = 0
+        self.overrides = 0
+        self.learned = 0
+
+    def lookup(self, vocabulary, version, terms):
+        # {term: target} for the terms with an override or a mapping learned against `version`
+        known = {}
+        for term, target, source_version in self.conn.execute(
+                "SELECT term, target, version FROM mappings WHERE vocabulary = ? AND version IN (?, '')",
+                (vocabulary, version)):
+            # Overrides are stored with an empty version
+            if source_version == '' or term not in known:
+                known[term] = target
+
+        found = {term: known[term] for term in terms if term in known}
+        self.hits += len(found)
+        return found
+
+    def update(self, vocabulary, version, mapping, source):
+        # Remember mappings learned in this run, e.g. source 'llm'
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO mappings VALUES (?, ?, ?, ?, ?, ?)",
+            [(vocabulary, term, version, target, source, now) for term, target in mapping.items()])
+        self.conn.commit()
+        self.learned += len(mapping)
+
+    def load_overrides(self, path):
+        # Manual overrides from a CSV file with Vocabulary, Term and Target columns
+        with open(path, newline='', encoding='utf-8') as file:
+            rows = [[row[column].strip() for column in OVERRIDE_COLUMNS] for row in csv.DictReader(file)]
+
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO mappings VALUES (?, ?, '', ?, 'override', ?)",
+            [(vocabulary, term, target, now) for vocabulary, term, target in rows])
+        self.conn.commit()
+        self.overrides += len(rows)
+
+    def report(self):
+        print(f"[Vocabulary] {self.hits} terms from the store, {self.learned} learned, "
+              f"{self.overrides} overrides loaded")
+
+    def close(self):
+        self.conn.close()
+
+
+def add_vocab_arguments(parser):
+    parser.add_argument('--vocab-store', default=DEFAULT_VOCAB_STORE_PATH,
+                        help=f"SQLite store of terms mapped in previous runs (default: {DEFAULT_VOCAB_STORE_PATH})")
+    parser.add_argument('--no-vocab-store', action='store_true',
+                        help="Map every term again and do not remember the mappings")
+    parser.add_argument('--vocab-overrides', default=None,
+                        help="CSV file with Vocabulary (Disease, Organ or Cancer), Term and Target columns, "
+                             "added to the store as manual mappings that always win")
+
+
+def vocab_from_args(args):
+    if args.no_vocab_store:
+        return None
+
+    store = VocabStore(args.vocab_store)
+    if args.vocab_overrides:
+        store.load_overrides(args.vocab_overrides)
+    return store